@@ -0,0 +1,187 @@
+"""
+Допуск запросов на запись (POST / PUT / DELETE) в pr_16_4_pydantic.py и pr_16_5_Jinja.py при перегрузке.
+
+Без ограничений всплеск записей выстраивается в бесконечную очередь на event loop, и вместе с записями
+растет задержка чтений (GET /users/{user_id}). install_admission(app) вызывается в конце модуля после
+маршрутов и ставит перед каждым маршрутом записи проверку - до чтения тела и валидации pydantic:
+
+- токен-бакет на клиента (адрес из scope["client"]): rate запросов в секунду, запас burst. Бакет общий
+  для всех маршрутов записи приложения. Превысил - 429 с Retry-After, когда появится следующий токен;
+- ограничение одновременных запросов на маршрут (concurrency). Остальные ждут в очереди, но не дольше
+  бюджета budget секунд: если по средней длительности запроса очередь точно не успеет, ответ 503 приходит
+  сразу, не дожидаясь бюджета; не дождался - тоже 503. Retry-After - оценка времени разбора очереди.
+
+Отказ стоит десятки микросекунд вместо полной обработки, поэтому под штормом записей event loop остается
+свободным для чтений. Маршруты GET не ограничиваются.
+
+Настройки по умолчанию - из окружения:
+    ADMISSION_CONCURRENCY       - одновременных запросов на маршрут записи (32);
+    ADMISSION_QUEUE_BUDGET_MS   - сколько запрос может ждать в очереди (50 мс);
+    ADMISSION_CLIENT_RATE       - запросов записи в секунду на клиента (0 - без ограничения, по умолчанию:
+                                  за прокси или NAT все клиенты выглядят одним адресом);
+    ADMISSION_CLIENT_BURST      - запас бакета (по умолчанию 2 * rate).
+Отдельному маршруту можно задать свою политику: install_admission(app, overrides={("POST", "/users"): ...}).
+Отказы видны в GET /metrics как ответы 429 и 503 маршрута.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import Response
+from fastapi.routing import APIRoute, request_response
+
+from metrics import ROUTE_KEY
+from response_cache import encode_json
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_CLIENTS = 10_000        # бакеты давно не писавших клиентов вытесняются
+SERVICE_TIME_WEIGHT = 0.2   # вес нового замера в скользящей средней длительности запроса
+
+
+class AdmissionPolicy(NamedTuple):
+    concurrency: int = int(os.getenv('ADMISSION_CONCURRENCY', '32'))
+    budget: float = float(os.getenv('ADMISSION_QUEUE_BUDGET_MS', '50')) / 1000
+    rate: float = float(os.getenv('ADMISSION_CLIENT_RATE', '0'))
+    burst: float = float(os.getenv('ADMISSION_CLIENT_BURST', '0'))
+
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: float = 0, max_clients: int = MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst or 2 * rate
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()     # клиент -> [токены, время]
+
+    def take(self, client: str, now: float) -> float:
+        # 0 - токен взят, иначе через сколько секунд появится следующий
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = [self.burst, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+
+class RouteLimiter:
+    def __init__(self, concurrency: int, budget: float):
+        self.concurrency = concurrency
+        self.budget = budget
+        self.active = 0
+        self.service_time = 0.0     # скользящая средняя длительность запроса, сек
+        self._waiters: deque = deque()
+
+    def expected_wait(self) -> float:
+        return (len(self._waiters) + 1) * self.service_time / self.concurrency
+
+    async def acquire(self) -> Optional[float]:
+        # None - запрос допущен (занял место), иначе - отказ и Retry-After в секундах
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return None
+        wait = self.expected_wait()
+        if wait > self.budget:
+            return self._reject(wait)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.budget)
+        except asyncio.TimeoutError:
+            return self._reject(self.expected_wait())
+        except BaseException:
+            # клиент отключился, пока ждал; если место уже передано - возвращаем его
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        return None
+
+    def release(self, elapsed: Optional[float] = None) -> None:
+        if elapsed is not None:
+            self.service_time += (elapsed - self.service_time) * SERVICE_TIME_WEIGHT
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)     # место переходит ожидающему, active не меняется
+                return
+        self.active -= 1
+
+    def _reject(self, wait: float) -> float:
+        return max(wait, self.service_time)
+
+
+def _overloaded(status: int, retry_after: float, detail: str, route_path: str, request) -> Response:
+    request.scope[ROUTE_KEY] = route_path
+    return Response(encode_json({"detail": detail}), status_code=status, media_type="application/json",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def _admitted(get_route_handler, route_path: str, limiter: RouteLimiter, buckets: Optional[TokenBuckets]):
+    # как и быстрый отказ в path_validators.py, обертка ставится на get_route_handler и переживает include_router
+    def admission_route_handler():
+        handler = get_route_handler()
+
+        async def admitted(request):
+            if buckets is not None:
+                client = request.scope.get("client")
+                wait = buckets.take(client[0] if client else "", time.monotonic())
+                if wait:
+                    return _overloaded(429, wait, "Слишком много запросов", route_path, request)
+            retry_after = await limiter.acquire()
+            if retry_after is not None:
+                return _overloaded(503, retry_after, "Сервер перегружен, повторите позже", route_path, request)
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                limiter.release(time.perf_counter() - start)
+        return admitted
+    return admission_route_handler
+
+
+def install_admission(app: Union[FastAPI, APIRouter], policy: Optional[AdmissionPolicy] = None,
+                      overrides: Optional[Dict[Tuple[str, str], AdmissionPolicy]] = None) -> None:
+    policy = policy or AdmissionPolicy()
+    overrides = overrides or {}
+    shared = {}     # один бакет клиента на все маршруты с одинаковыми rate/burst
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or getattr(route, "admission", None) is not None:
+            continue
+        methods = route.methods & WRITE_METHODS
+        if not methods:
+            continue
+        route_policy = next((overrides[(method, route.path)] for method in sorted(methods)
+                             if (method, route.path) in overrides), policy)
+        admit_route(route, route_policy, shared)
+
+
+def admit_route(route: APIRoute, policy: AdmissionPolicy, shared: Optional[dict] = None) -> None:
+    # Допуск на один маршрут. shared - бакеты клиентов по (rate, burst), общие для маршрутов одного приложения.
+    # Политика остается на маршруте (admission_policy): service.py переносит ее вместе с маршрутом
+    buckets = None
+    if policy.rate > 0:
+        shared = {} if shared is None else shared
+        key = (policy.rate, policy.burst)
+        buckets = shared.get(key) or shared.setdefault(key, TokenBuckets(policy.rate, policy.burst))
+    limiter = RouteLimiter(policy.concurrency, policy.budget)
+    route.get_route_handler = _admitted(route.get_route_handler, route.path, limiter, buckets)
+    route.app = request_response(route.get_route_handler())
+    route.admission = limiter
+    route.admission_policy = policy
+
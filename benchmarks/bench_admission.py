@@ -0,0 +1,132 @@
+"""
+Шторм записей и задержка чтений: pr_16_5_Jinja.py с допуском записей (admission.py) и без него.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_admission
+    python -m benchmarks.bench_admission --rate 8000 --seconds 5
+
+Записи POST /users приходят с постоянной частотой --rate в секунду независимо от ответов (как всплеск
+от многих клиентов), она выше, чем event loop успевает обработать. Параллельно --readers клиентов читают
+GET /users/{user_id} один за другим. Печатаются p50/p99/max чтений, сколько записей выполнено
+и отклонено, и сколько записей осталось в очереди к концу замера.
+
+Запросы вызывают ASGI-приложение напрямую, в процессе и без HTTP-клиента. Чтобы запросы чередовались
+на event loop, как с настоящими сокетами, чтение тела запроса (receive) один раз отдает управление циклу.
+
+Вариант "без допуска" - то же приложение с ADMISSION_CONCURRENCY и бюджетом ожидания, которых не достичь;
+каждый вариант запускается в отдельном процессе, потому что настройки читаются при импорте.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+VARIANTS = {
+    "без допуска": {"ADMISSION_CONCURRENCY": "1000000", "ADMISSION_QUEUE_BUDGET_MS": "1000000000"},
+    "admission": {},
+}
+
+
+def call(app, method: str, path: str, body: bytes = b''):
+    # один запрос прямо в ASGI-приложение, без HTTP-клиента: на event loop работает только сервер.
+    # Чтение тела (receive) один раз отдает управление циклу, как чтение из сокета
+    scope = {'type': 'http', 'method': method, 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+             'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+             'root_path': '', 'scheme': 'http', 'server': ('bench', 80), 'client': ('10.0.0.1', 40000),
+             'http_version': '1.1', 'asgi': {'version': '3.0'}}
+    status = []
+
+    async def receive():
+        await asyncio.sleep(0)
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    async def run():
+        await app(scope, receive, send)
+        return status[0]
+    return run()
+
+
+def child(rate: int, seconds: float, readers: int) -> None:
+    warnings.simplefilter('ignore')
+    import pr_16_5_Jinja
+
+    app = pr_16_5_Jinja.app
+    pr_16_5_Jinja.users.create_many([(f'user{i}', 20 + i % 50) for i in range(1000)])
+
+    async def run():
+        statuses, reads, pending = {}, [], set()
+        end = time.perf_counter() + seconds
+
+        async def write(n):
+            status = await call(app, 'POST', '/users', b'{"username": "storm%08d", "age": 30}' % n)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        async def reader(i):
+            user_id = 1 + i
+            while time.perf_counter() < end:
+                start = time.perf_counter()
+                assert await call(app, 'GET', f'/users/{user_id}') == 200
+                reads.append(time.perf_counter() - start)
+                user_id = user_id % 1000 + 1
+                await asyncio.sleep(0)
+
+        readers_done = asyncio.gather(*(reader(i) for i in range(readers)))
+        start, sent = time.perf_counter(), 0
+        while time.perf_counter() < end:
+            due = int((time.perf_counter() - start) * rate)
+            for n in range(sent, due):
+                task = asyncio.ensure_future(write(n))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            sent = max(sent, due)
+            await asyncio.sleep(0.001)
+        await readers_done
+        backlog = len(pending)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return statuses, sorted(reads), backlog, sent
+
+    statuses, reads, backlog, sent = asyncio.run(run())
+    pick = lambda q: reads[min(len(reads) - 1, int(q * len(reads)))] * 1000
+    print(json.dumps({"p50": pick(0.5), "p99": pick(0.99), "max": reads[-1] * 1000, "reads": len(reads),
+                      "sent": sent, "statuses": statuses, "backlog": backlog}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.rate, args.seconds, args.readers)
+        return
+
+    print(f'POST /users: {args.rate}/с в течение {args.seconds} с, {args.readers} читателя GET /users/{{user_id}}')
+    print(f'{"":<14} {"p50, мс":>8} {"p99, мс":>8} {"max, мс":>8} {"чтений":>7} {"записей 200":>12} '
+          f'{"503/429":>8} {"в очереди":>10}')
+    for name, env in VARIANTS.items():
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_admission', '--child', '--rate', str(args.rate),
+             '--seconds', str(args.seconds), '--readers', str(args.readers)],
+            env={**os.environ, **env}, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        statuses = result["statuses"]
+        rejected = statuses.get("503", 0) + statuses.get("429", 0)
+        print(f'{name:<14} {result["p50"]:>8.1f} {result["p99"]:>8.1f} {result["max"]:>8.1f} {result["reads"]:>7} '
+              f'{statuses.get("200", 0):>12} {rejected:>8} {result["backlog"]:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Задержки CRUD-маршрутов pr_16_4_pydantic.py под конкурентной нагрузкой: хранилище в памяти против SQLite.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_backends
+    python -m benchmarks.bench_backends --concurrency 64 --cycles 50 --preload 10000
+
+Каждый из --concurrency клиентов выполняет --cycles циклов POST /users -> GET /users?limit=50 ->
+PUT /users/{id}/{username}/{age} -> DELETE /users/{id}. Запросы идут через httpx.ASGITransport
+(в процессе, без сети), для каждого маршрута печатаются p50/p99.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+
+warnings.simplefilter('ignore')
+
+import httpx
+
+import pr_16_4_pydantic
+from benchmarks.common import summarize
+from sqlite_repository import SQLiteUserRepository
+from user_repository import UserRepository
+
+
+async def worker(client, worker_id, cycles, latencies):
+    async def timed(route, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        latencies[route].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'{method} {url}: {response.status_code} {response.text[:200]}')
+        return response
+
+    for cycle in range(cycles):
+        name = f'w{worker_id}c{cycle}'
+        created = await timed('POST /users', 'POST', '/users', json={'username': name, 'age': 30})
+        user_id = created.json()['id']
+        await timed('GET /users?limit=50', 'GET', '/users', params={'limit': 50})
+        await timed('PUT /users/{id}', 'PUT', f'/users/{user_id}/{name}_x/31')
+        await timed('DELETE /users/{id}', 'DELETE', f'/users/{user_id}')
+
+
+async def run(store, concurrency, cycles, preload):
+    if isinstance(store, UserRepository):
+        store.create_many([(f'pre{i}', 30) for i in range(preload)])
+    else:
+        await store.create_many([(f'pre{i}', 30) for i in range(preload)])
+    pr_16_4_pydantic.users = store
+    latencies = defaultdict(list)
+    transport = httpx.ASGITransport(app=pr_16_4_pydantic.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, i, cycles, latencies) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    total = sum(len(values) for values in latencies.values())
+    return latencies, total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--preload', type=int, default=1000, help='пользователей в хранилище до начала замера')
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': UserRepository(pr_16_4_pydantic.User),
+            'sqlite': SQLiteUserRepository(pr_16_4_pydantic.User, os.path.join(tmp, 'bench.sqlite3'), args.pool_size),
+        }
+        for name, store in backends.items():
+            latencies, rps = asyncio.run(run(store, args.concurrency, args.cycles, args.preload))
+            print(f'\n{name}: {rps:,.0f} req/s, concurrency {args.concurrency}')
+            print(f'  {"route":<22} {"p50 ms":>8} {"p99 ms":>8}')
+            for route, values in latencies.items():
+                stats = summarize(values)
+                print(f'  {route:<22} {stats["p50_ms"]:>8.2f} {stats["p99_ms"]:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Пропускная способность одиночных POST /users в pr_16_4_pydantic.py: пакеты WriteCoalescer (coalescer.py)
+против применения каждого запроса отдельно.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_coalesce
+    python -m benchmarks.bench_coalesce --clients 256 --requests 20000
+
+--clients клиентов одновременно отправляют POST /users, каждый следующий - после ответа на предыдущий,
+всего --requests запросов. Запросы вызывают ASGI-приложение напрямую (как в bench_admission.py).
+Хранилища: в памяти, в памяти с журналом (USERS_DATA_DIR) и SQLite (USERS_BACKEND=sqlite), каждое -
+в отдельном процессе и во временном каталоге. "по одному" - тот же WriteCoalescer с max_batch=1.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKENDS = {
+    "память": {},
+    "память + журнал": {"USERS_DATA_DIR": None},
+    "SQLite": {"USERS_BACKEND": "sqlite", "USERS_DATA_DIR": None},
+}
+
+
+def child(clients: int, requests: int, max_batch: int) -> None:
+    import asyncio
+    import time
+    import warnings
+    warnings.simplefilter('ignore')
+    import pr_16_4_pydantic
+    from benchmarks.bench_admission import call
+
+    pr_16_4_pydantic.creates.max_batch = max_batch
+    app, counter = pr_16_4_pydantic.app, iter(range(requests))
+
+    async def client():
+        for n in counter:
+            assert await call(app, 'POST', '/users', b'{"username": "bench%08d", "age": 30}' % n) == 200
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    creates = pr_16_4_pydantic.creates
+    print(json.dumps({"rps": requests / elapsed, "batch": creates.items / max(1, creates.batches)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--child', type=int, metavar='MAX_BATCH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.clients, args.requests, args.child)
+        return
+
+    print(f'{args.requests} запросов POST /users, {args.clients} клиентов')
+    print(f'{"":<18} {"по одному, rps":>15} {"пакетами, rps":>14} {"средний пакет":>14}')
+    for name, overrides in BACKENDS.items():
+        row = []
+        for max_batch in (1, 512):
+            with tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, 'ADMISSION_CONCURRENCY': '1000000'}
+                env.update({key: directory if value is None else value for key, value in overrides.items()})
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_coalesce', '--child', str(max_batch),
+                     '--clients', str(args.clients), '--requests', str(args.requests)],
+                    env=env, check=True, capture_output=True, text=True).stdout
+                row.append(json.loads(output.strip().splitlines()[-1]))
+        print(f'{name:<18} {row[0]["rps"]:>15.0f} {row[1]["rps"]:>14.0f} {row[1]["batch"]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
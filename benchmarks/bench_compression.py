@@ -0,0 +1,70 @@
+"""
+Сжатие ответов: размер тела и цена запроса для страницы "/" и GET /users из pr_16_5_Jinja.py (режим fast_json).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_compression
+    python -m benchmarks.bench_compression --users 100000 --requests 200
+
+Для каждой доступной кодировки (precompressed.CODECS) и без сжатия печатаются размер ответа, время запроса,
+когда сжатый вариант берется из кэша рядом с телом (так работают маршруты), и время одного сжатия тела -
+столько добавлял бы к каждому запросу вариант без кэша (например, GZipMiddleware).
+Время запроса со сжатием включает распаковку ответа в клиенте (httpx).
+"""
+
+import argparse
+import os
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+os.environ['USERS_FAST_JSON'] = '1'
+
+from fastapi.testclient import TestClient
+
+import precompressed
+import pr_16_5_Jinja
+from user_repository import UserRepository
+
+
+def timed_requests(client: TestClient, path: str, encoding: str, count: int):
+    response = client.get(path, headers={'accept-encoding': encoding})
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path, headers={'accept-encoding': encoding})
+    return int(response.headers['content-length']), (time.perf_counter() - start) / count, response.content
+
+
+def compression_time(encoding: str, body: bytes, count: int) -> float:
+    compress = precompressed.CODECS[encoding]
+    start = time.perf_counter()
+    for _ in range(count):
+        compress(body)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    users = UserRepository(pr_16_5_Jinja.User, fast_json=True)
+    users.create_many([(f'user{i}', 18 + i % 80) for i in range(args.users)])
+    pr_16_5_Jinja.users = users
+    client = TestClient(pr_16_5_Jinja.app)
+
+    print(f'{args.users:,} пользователей, {args.requests} запросов на замер')
+    print(f'{"":<8} {"кодировка":<10} {"байт":>10} {"запрос, мс":>11} {"сжатие, мс":>11}')
+    for path in ('/', '/users'):
+        body = None
+        for encoding in ('identity', *precompressed.CODECS):
+            size, elapsed, content = timed_requests(client, path, encoding, args.requests)
+            if encoding == 'identity':
+                body, compress = content, '-'
+            else:
+                compress = f'{compression_time(encoding, body, args.requests) * 1000:.2f}'
+            print(f'{path:<8} {encoding:<10} {size:>10} {elapsed * 1000:>11.2f} {compress:>11}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Микробенчмарк вставки для pr_16_3_CRUD.py: старый вариант (max по всем ключам + 1) против UserRecords.add.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_crud_insert
+    python -m benchmarks.bench_crud_insert --sizes 10000 100000 --budget 0.5
+
+Для каждого размера хранилище сначала заполняется до N пользователей, затем замеряется скорость
+следующих вставок. Старый вариант при N = 1M делает ~1M операций на каждую вставку, поэтому замер
+ограничен по времени (--budget секунд), а не по числу вставок.
+"""
+
+import argparse
+import time
+
+from user_repository import UserRecords
+
+
+def legacy_insert(users, username, age):
+    user_id = str(max(int(key) for key in users.keys()) + 1) if users else '1'
+    users[user_id] = f'Имя: {username}, возраст: {age}'
+    return user_id
+
+
+def records_insert(users, username, age):
+    return users.add(f'Имя: {username}, возраст: {age}')
+
+
+def fill_legacy(size):
+    return {str(i): f'Имя: user{i}, возраст: 30' for i in range(1, size + 1)}
+
+
+def fill_records(size):
+    users = UserRecords()
+    for i in range(1, size + 1):
+        users.add(f'Имя: user{i}, возраст: 30')
+    return users
+
+
+def measure(insert, users, budget, max_ops):
+    done = 0
+    start = time.perf_counter()
+    while done < max_ops:
+        insert(users, f'new{done}', 30)
+        done += 1
+        if time.perf_counter() - start >= budget:
+            break
+    elapsed = time.perf_counter() - start
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--budget', type=float, default=1.0, help='секунд на один замер')
+    parser.add_argument('--max-ops', type=int, default=100_000, help='максимум вставок на один замер')
+    args = parser.parse_args()
+
+    print(f'{"users":>10} {"legacy ops/s":>15} {"UserRecords ops/s":>18} {"speedup":>9}')
+    for size in args.sizes:
+        legacy = measure(legacy_insert, fill_legacy(size), args.budget, args.max_ops)
+        records = measure(records_insert, fill_records(size), args.budget, args.max_ops)
+        print(f'{size:>10} {legacy:>15,.0f} {records:>18,.0f} {records / legacy:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
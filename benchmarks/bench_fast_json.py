@@ -0,0 +1,67 @@
+"""
+Бенчмарк режима fast_json в pr_16_4_pydantic.py: кодирование списков целиком (encode_rows) против
+склейки JSON-байтов, закэшированных в каждой записи.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_fast_json
+    python -m benchmarks.bench_fast_json --sizes 100 1000 --budget 1
+
+Готовая страница GET /users в обоих режимах берется из кэша bodies, поэтому замеряются маршруты, где режимы
+отличаются:
+    GET /users после изменения      - перед каждым запросом меняется один пользователь, и кэш страницы
+                                      пуст (холодное кодирование всей коллекции);
+    GET /users/search?limit=1000    - страница поиска не кэшируется и кодируется на каждый запрос.
+
+Запросы идут через TestClient (в процессе, без сети), поэтому абсолютные цифры ниже, чем под uvicorn,
+но соотношение режимов показательно.
+"""
+
+import argparse
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+
+from fastapi.testclient import TestClient
+
+import pr_16_4_pydantic
+from user_repository import UserRepository
+
+
+def requests_per_second(client, users, url, change, budget):
+    done = spent = 0.0
+    while spent < budget:
+        if change:
+            users.update(1 + int(done) % len(users), f'changed{int(done)}', 31)    # вне замера
+        start = time.perf_counter()
+        response = client.get(url)
+        spent += time.perf_counter() - start
+        assert response.status_code == 200
+        done += 1
+    return done / spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1_000, 10_000])
+    parser.add_argument('--budget', type=float, default=2.0, help='секунд на один замер')
+    args = parser.parse_args()
+
+    client = TestClient(pr_16_4_pydantic.app)
+    routes = (('GET /users после изменения', '/users', True),
+              ('GET /users/search?limit=1000', '/users/search?age_min=1&limit=1000', False))
+    print(f'{"route":<30} {"users":>8} {"encode_rows req/s":>18} {"fast_json req/s":>16} {"speedup":>8}')
+    for label, url, change in routes:
+        for size in args.sizes:
+            results = []
+            for fast_json in (False, True):
+                users = UserRepository(pr_16_4_pydantic.User, fast_json=fast_json)
+                users.create_many([(f'user{i}', 30) for i in range(size)])
+                pr_16_4_pydantic.users = users
+                client.get(url)  # прогрев: в режиме fast_json заполняет кэш байтов записей
+                results.append(requests_per_second(client, users, url, change, args.budget))
+            print(f'{label:<30} {size:>8} {results[0]:>18,.0f} {results[1]:>16,.0f} {results[1] / results[0]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
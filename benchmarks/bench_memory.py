@@ -0,0 +1,69 @@
+"""
+Память на хранение пользователей: список моделей User (как users: List[User] в исходном pr_16_4_pydantic.py)
+против UserRepository, который держит компактные записи UserRecord на __slots__.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --users 100000
+
+Память считается через tracemalloc: сколько байт осталось занятым после заполнения хранилища.
+В обоих вариантах строки username одинаковые, в UserRepository дополнительно учтены все его индексы
+(username -> id, отсортированные id, (age, id) и username для поиска).
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+import warnings
+
+warnings.simplefilter('ignore')
+
+from pr_16_4_pydantic import User
+from user_repository import UserRecord, UserRepository
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    store = build()
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return store, used, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    args = parser.parse_args()
+    n = args.users
+    names = [f'user{i}' for i in range(n)]     # общие для всех вариантов, в замер не входят
+
+    variants = {
+        'List[User]': lambda: [User(id=i + 1, username=names[i], age=18 + i % 80) for i in range(n)],
+        'UserRecord (только записи)': lambda: [UserRecord(i + 1, names[i], 18 + i % 80) for i in range(n)],
+        'UserRepository': lambda: _repository(names),
+    }
+    print(f'{n:,} пользователей (время заполнения - под tracemalloc, оно завышено)')
+    print(f'{"":<28} {"MiB":>8} {"байт/польз.":>12} {"сек":>6}')
+    results = {}
+    for label, build in variants.items():
+        store, used, elapsed = measure(build)
+        results[label] = used
+        print(f'{label:<28} {used / 2 ** 20:>8.1f} {used / n:>12.0f} {elapsed:>6.1f}')
+        del store
+    print(f'\nUserRepository / List[User]: {results["UserRepository"] / results["List[User]"]:.2f}')
+
+
+def _repository(names):
+    users = UserRepository(User)
+    users.create_many([(name, 18 + i % 80) for i, name in enumerate(names)])
+    users.search(age_min=0)     # вливает отложенные ключи в индексы поиска - они тоже должны попасть в замер
+    return users
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Накладные расходы метрик (metrics.py): одно и то же приложение с install_metrics и без него.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_metrics_overhead
+    python -m benchmarks.bench_metrics_overhead --requests 20000
+
+Маршруты - как в pr_16_1_fast_api.py (GET /user/{user_id}) и pr_16_4_pydantic.py (POST /users с телом).
+Запросы идут через httpx.ASGITransport (в процессе, без сети), поэтому разница в p50 - почти целиком
+стоимость middleware и замеров фаз.
+"""
+
+import argparse
+import asyncio
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+
+import httpx
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from benchmarks.common import summarize
+from metrics import install_metrics
+
+
+class UserCreate(BaseModel):
+    username: str
+    age: int
+
+
+def build_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+    if with_metrics:
+        install_metrics(app)
+
+    @app.get('/user/{user_id}')
+    async def user_info(user_id: int):
+        return {"message": f"Вы вошли как пользователь № {user_id}"}
+
+    @app.post('/users')
+    async def create_user(user: UserCreate):
+        return {"id": 1, "username": user.username, "age": user.age}
+
+    return app
+
+
+async def measure(app, requests):
+    latencies = {'GET /user/{user_id}': [], 'POST /users': []}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for i in range(requests):
+            start = time.perf_counter()
+            await client.get(f'/user/{i}')
+            latencies['GET /user/{user_id}'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await client.post('/users', json={'username': f'user{i}', 'age': 30})
+            latencies['POST /users'].append(time.perf_counter() - start)
+    return {route: summarize(values) for route, values in latencies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5_000, help='запросов на маршрут')
+    args = parser.parse_args()
+
+    asyncio.run(measure(build_app(True), 200))     # прогрев импорта и первых вызовов
+    plain = asyncio.run(measure(build_app(False), args.requests))
+    timed = asyncio.run(measure(build_app(True), args.requests))
+    print(f'{"route":<22} {"p50 без":>9} {"p50 с":>9} {"p99 без":>9} {"p99 с":>9} {"+µs p50":>8}')
+    for route in plain:
+        a, b = plain[route], timed[route]
+        print(f'{route:<22} {a["p50_ms"]:>8.3f}ms {b["p50_ms"]:>8.3f}ms {a["p99_ms"]:>8.3f}ms '
+              f'{b["p99_ms"]:>8.3f}ms {(b["p50_ms"] - a["p50_ms"]) * 1000:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Снимки хранилища (UserRepository.snapshot): задержка event loop при рендере большого списка и согласованность
+чтений под записью.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_snapshot
+    python -m benchmarks.bench_snapshot --users 50000 --rounds 20
+
+1. Рендер users.html для --users пользователей --rounds раз, перед каждым рендером - изменение хранилища
+   (кэш страницы не срабатывает). Фоновая задача каждую миллисекунду проверяет, насколько event loop
+   опоздал ее разбудить: max - самая долгая блокировка цикла. В event loop (render) против потока (render_async).
+2. Поток-писатель непрерывно меняет пользователей (username всегда "n<age>"), event loop в это время
+   кодирует снимки в JSON в другом потоке. Считаются записи, где username не соответствует age
+   (полупримененное изменение), - их должно быть 0.
+3. Цена snapshot(): без изменений (один и тот же объект) и первый вызов после изменения.
+"""
+
+import argparse
+import asyncio
+import gc
+import threading
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+
+from fastapi import Request
+
+from pr_16_5_Jinja import User
+from user_pages import PageRenderer
+from user_repository import UserRepository
+
+
+def fill(n: int) -> UserRepository:
+    users = UserRepository(User, fast_json=True)
+    users.create_many([(f'n{18 + i % 80}-{i}', 18 + i % 80) for i in range(n)])
+    return users
+
+
+async def loop_lag(users: UserRepository, pages: PageRenderer, rounds: int, in_thread: bool) -> float:
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': [], 'query_string': b''})
+    worst, done = 0.0, False
+
+    async def ticker():
+        nonlocal worst
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            worst = max(worst, time.perf_counter() - start - 0.001)
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0.01)
+    for i in range(rounds):
+        users.update(1, f'renamed{i}', 30)
+        context = lambda: {"users": users.all()}
+        if in_thread:
+            await pages.render_async(request, "users.html", "users", users.version, context)
+        else:
+            pages.render(request, "users.html", "users", users.version, context)
+        await asyncio.sleep(0.002)
+    done = True
+    await task
+    return worst
+
+
+def torn_reads(users: UserRepository, seconds: float) -> tuple:
+    stop = threading.Event()
+
+    def writer():
+        k = 0
+        while not stop.is_set():
+            age = 18 + k % 80
+            users.update(1 + k % len(users), f'n{age}-{k}', age)
+            k += 1
+
+    async def readers():
+        torn = reads = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            snapshot = users.snapshot()
+            bad = await asyncio.to_thread(
+                lambda: sum(1 for user in snapshot if not user.username.startswith(f'n{user.age}-')))
+            await asyncio.to_thread(users.encode_list, snapshot)
+            torn += bad
+            reads += 1
+        return torn, reads
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        return asyncio.run(readers())
+    finally:
+        stop.set()
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    users, pages = fill(args.users), PageRenderer()
+    print(f'{args.users:,} пользователей')
+    for label, in_thread in (('рендер в event loop', False), ('рендер в потоке', True)):
+        worst = asyncio.run(loop_lag(users, pages, args.rounds, in_thread))
+        print(f'{label:<22} макс. задержка event loop {worst * 1000:7.1f} мс')
+
+    torn, reads = torn_reads(users, args.seconds)
+    print(f'снимков прочитано под записью: {reads}, полупримененных записей: {torn}')
+
+    snapshot = users.snapshot()
+    start = time.perf_counter()
+    for _ in range(1000):
+        users.snapshot()
+    same = (time.perf_counter() - start) / 1000
+    users.update(1, 'changed', 30)
+    start = time.perf_counter()
+    users.snapshot()
+    fresh = time.perf_counter() - start
+    print(f'snapshot(): без изменений {same * 1e6:.2f} мкс, первый после изменения {fresh * 1000:.2f} мс')
+    del snapshot
+    gc.collect()
+    print(f'живых снимков после того, как читатели их отпустили: {users.live_snapshots}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Холодный старт и память: пять отдельных приложений pr_16_1 ... pr_16_5 против одного service.py.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 5
+
+Каждый вариант запускается в новом процессе интерпретатора (--runs раз, берется медиана):
+    import     - импорт модуля и сборка приложения (для service.py - всех пяти модулей и общего роутера);
+    first      - первый запрос после импорта, для service.py это GET /jinja/ - в нем же импортируется
+                 jinja2 и компилируется шаблон;
+    rss        - пиковый RSS процесса (ru_maxrss) после первого запроса.
+Строка "5 процессов" - сумма по отдельным приложениям: столько стоило держать их запущенными по отдельности.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = {
+    "pr_16_1_fast_api": ("pr_16_1_fast_api", "/"),
+    "pr_16_2_path": ("pr_16_2_path", "/"),
+    "pr_16_3_CRUD": ("pr_16_3_CRUD", "/users"),
+    "pr_16_4_pydantic": ("pr_16_4_pydantic", "/users"),
+    "pr_16_5_Jinja": ("pr_16_5_Jinja", "/"),
+    "service": ("service", "/jinja/"),
+}
+
+
+def child(module_name: str, path: str) -> None:
+    # выполняется в отдельном процессе: печатает одну строку JSON
+    import time
+    start = time.perf_counter()
+    import asyncio
+    import importlib
+    import logging
+    import resource
+    import warnings
+    warnings.simplefilter('ignore')
+    logging.disable(logging.WARNING)
+    import httpx
+    module = importlib.import_module(module_name)
+    imported = time.perf_counter()
+
+    async def first_request():
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return (await client.get(path)).status_code
+
+    status = asyncio.run(first_request())
+    done = time.perf_counter()
+    print(json.dumps({"import": imported - start, "first": done - imported, "status": status,
+                      "rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def measure(name: str, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--child", name],
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in ("import", "first", "rss_kib")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--child', choices=sorted(TARGETS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*TARGETS[args.child])
+        return
+
+    print(f'{"":<18} {"import, мс":>11} {"first, мс":>10} {"RSS, MiB":>9}')
+    total = {"import": 0.0, "first": 0.0, "rss_kib": 0}
+    results = {}
+    for name in TARGETS:
+        results[name] = result = measure(name, args.runs)
+        if name != "service":
+            for key in total:
+                total[key] += result[key]
+    rows = [(name, results[name]) for name in TARGETS if name != "service"]
+    rows += [("5 процессов", total), ("service", results["service"])]
+    for name, result in rows:
+        print(f'{name:<18} {result["import"] * 1000:>11.0f} {result["first"] * 1000:>10.1f} '
+              f'{result["rss_kib"] / 1024:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
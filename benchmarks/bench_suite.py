@@ -0,0 +1,226 @@
+"""
+Нагрузочный прогон всех приложений pr_16_1 ... pr_16_5 с сохранением базовых результатов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --sizes 100 10000 --cycles 300 --save benchmarks/baseline.json
+    python -m benchmarks.bench_suite --compare benchmarks/baseline.json --tolerance 0.25
+
+Сценарии (каждый клиент из --concurrency выполняет --cycles циклов):
+    fast_api  - GET /user/{user_id} из pr_16_1_fast_api.py;
+    path      - маршруты pr_16_2_path.py с проверками Path: корректные запросы и один отклоняемый (422);
+    crud      - POST -> GET ?limit=50 -> PUT -> DELETE в pr_16_3_CRUD.py;
+    pydantic  - POST -> GET ?limit=50 -> PUT -> DELETE в pr_16_4_pydantic.py;
+    jinja     - PUT (меняет версию, страница рендерится заново) -> GET / -> GET /users/{id} в pr_16_5_Jinja.py.
+
+Перед замером хранилище приложения заменяется новым, в памяти, с --sizes пользователями
+(pr_16_2 хранилища не имеет и прогоняется один раз). Запросы идут через httpx.ASGITransport - в процессе,
+без сети. Для каждого сценария печатаются запросы в секунду и p50/p95/p99 по маршрутам, затем отдельный
+проход под tracemalloc (он сильно замедляет код, поэтому время в нем не меряется) дает пик памяти
+за проход и сколько байт остается занятым в расчете на запрос.
+
+--save пишет результаты в JSON, --compare сравнивает с сохраненными и завершается с кодом 1,
+если пропускная способность упала или p50/p99 выросли больше чем на --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+warnings.simplefilter('ignore')
+
+import httpx
+
+import pr_16_1_fast_api
+import pr_16_2_path
+import pr_16_3_CRUD
+import pr_16_4_pydantic
+import pr_16_5_Jinja
+from benchmarks.common import summarize
+from user_repository import UserRecords, UserRepository
+
+
+class Scenario(NamedTuple):
+    app: object
+    load: Optional[Callable[[int], None]]     # None - у приложения нет хранилища
+    cycle: Callable                           # async (call, worker_id, cycle) -> None
+
+
+def load_fast_api(size):
+    pr_16_1_fast_api.users = {i: {"username": f"user{i}", "age": 30} for i in range(1, size + 1)}
+    pr_16_1_fast_api.cache.clear()
+
+
+def load_crud(size):
+    pr_16_3_CRUD.users = UserRecords({str(i): f'Имя: user{i}, возраст: 30' for i in range(1, size + 1)})
+
+
+def load_pydantic(size):
+    pr_16_4_pydantic.users = UserRepository(pr_16_4_pydantic.User, fast_json=pr_16_4_pydantic.FAST_JSON)
+    pr_16_4_pydantic.users.create_many([(f'user{i}', 30) for i in range(size)])
+
+
+def load_jinja(size):
+    pr_16_5_Jinja.users = UserRepository(pr_16_5_Jinja.User, fast_json=pr_16_5_Jinja.FAST_JSON)
+    pr_16_5_Jinja.users.create_many([(f'user{i}', 30) for i in range(size)])
+
+
+async def cycle_fast_api(call, worker_id, cycle):
+    await call('GET /user/{user_id}', 'GET', f'/user/{cycle % 3 + 1}')
+
+
+async def cycle_path(call, worker_id, cycle):
+    await call('GET /user/{user_id}', 'GET', f'/user/{cycle % 100 + 1}')
+    await call('GET /user/{username}/{age}', 'GET', '/user/Urban Uni/24')
+    await call('GET /user/{username}/{age} 422', 'GET', '/user/User123/24', status=422)
+
+
+async def cycle_crud(call, worker_id, cycle):
+    created = await call('POST /users/{username}/{age}', 'POST', f'/users/w{worker_id}c{cycle}/30')
+    user_id = created.json().split()[1].rstrip(',')     # "User <id>, <username> is registered"
+    await call('GET /users?limit=50', 'GET', '/users', params={'limit': 50})
+    await call('PUT /users/{user_id}', 'PUT', f'/users/{user_id}', params={'username': 'renamed', 'age': 31})
+    await call('DELETE /users/{user_id}', 'DELETE', f'/users/{user_id}')
+
+
+async def cycle_pydantic(call, worker_id, cycle):
+    name = f'w{worker_id}c{cycle}'
+    created = await call('POST /users', 'POST', '/users', json={'username': name, 'age': 30})
+    user_id = created.json()['id']
+    await call('GET /users?limit=50', 'GET', '/users', params={'limit': 50})
+    await call('PUT /users/{id}/{username}/{age}', 'PUT', f'/users/{user_id}/{name}_x/31')
+    await call('DELETE /users/{user_id}', 'DELETE', f'/users/{user_id}')
+
+
+async def cycle_jinja(call, worker_id, cycle):
+    await call('PUT /users/{id}/{username}/{age}', 'PUT', f'/users/1/user0_{cycle % 2}/30')
+    await call('GET /', 'GET', '/')
+    await call('GET /users/{user_id}', 'GET', '/users/1')
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'fast_api': Scenario(pr_16_1_fast_api.app, load_fast_api, cycle_fast_api),
+    'path': Scenario(pr_16_2_path.app, None, cycle_path),
+    'crud': Scenario(pr_16_3_CRUD.app, load_crud, cycle_crud),
+    'pydantic': Scenario(pr_16_4_pydantic.app, load_pydantic, cycle_pydantic),
+    'jinja': Scenario(pr_16_5_Jinja.app, load_jinja, cycle_jinja),
+}
+
+
+async def drive(scenario: Scenario, concurrency: int, cycles: int):
+    latencies = defaultdict(list)
+    transport = httpx.ASGITransport(app=scenario.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def call(route, method, url, status=200, **kwargs):
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies[route].append(time.perf_counter() - start)
+            if response.status_code != status:
+                raise RuntimeError(f'{method} {url}: {response.status_code} {response.text[:200]}')
+            return response
+
+        async def worker(worker_id):
+            for cycle in range(cycles):
+                await scenario.cycle(call, worker_id, cycle)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def run_scenario(scenario: Scenario, size: int, concurrency: int, cycles: int) -> dict:
+    if scenario.load is not None:
+        scenario.load(size)
+    asyncio.run(drive(scenario, 1, min(cycles, 20)))    # прогрев: импорт, кэши FastAPI, байткод шаблонов
+
+    if scenario.load is not None:
+        scenario.load(size)
+    latencies, elapsed = asyncio.run(drive(scenario, concurrency, cycles))
+    total = sum(len(values) for values in latencies.values())
+
+    if scenario.load is not None:
+        scenario.load(size)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    asyncio.run(drive(scenario, concurrency, cycles))
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'requests': total,
+        'rps': total / elapsed,
+        'routes': {route: summarize(values) for route, values in latencies.items()},
+        'alloc_peak_kib': (peak - before) / 1024,
+        'retained_bytes_per_request': (after - before) / total,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if result['rps'] < old['rps'] * (1 - tolerance):
+            regressions.append(f'{key}: {old["rps"]:,.0f} -> {result["rps"]:,.0f} req/s')
+        for route, stats in result['routes'].items():
+            old_stats = old['routes'].get(route)
+            if old_stats is None:
+                continue
+            for name in ('p50_ms', 'p99_ms'):
+                if stats[name] > old_stats[name] * (1 + tolerance):
+                    regressions.append(f'{key} {route}: {name} {old_stats[name]:.3f} -> {stats[name]:.3f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000], help='пользователей в хранилище')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--cycles', type=int, default=100, help='циклов на одного клиента')
+    parser.add_argument('--save', help='записать результаты в JSON-файл')
+    parser.add_argument('--compare', help='сравнить с результатами из JSON-файла')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        for size in (args.sizes if scenario.load is not None else [0]):
+            key = f'{name}@{size}'
+            result = results[key] = run_scenario(scenario, size, args.concurrency, args.cycles)
+            print(f'\n{key}: {result["rps"]:,.0f} req/s, пик памяти {result["alloc_peak_kib"]:,.0f} KiB, '
+                  f'остается {result["retained_bytes_per_request"]:,.0f} B/запрос')
+            print(f'  {"route":<32} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+            for route, stats in result['routes'].items():
+                print(f'  {route:<32} {stats["p50_ms"]:>8.3f} {stats["p95_ms"]:>8.3f} {stats["p99_ms"]:>8.3f}')
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'concurrency': args.concurrency,
+                       'cycles': args.cycles, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f'\nрезультаты сохранены в {args.save}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        print(f'\nсравнение с {args.compare} (допуск {args.tolerance:.0%}):')
+        for line in regressions or ['  ухудшений нет']:
+            print(f'  {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
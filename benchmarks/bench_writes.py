@@ -0,0 +1,57 @@
+"""
+Цена одной записи в UserRepository на большом хранилище: create, update (новое имя и возраст) и delete.
+Каждая из них держит в порядке индексы id, username и (age, id), поэтому время не должно расти с N.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_writes
+    python -m benchmarks.bench_writes --sizes 100000 1000000 --ops 5000
+
+Для каждого размера хранилище заполняется до N пользователей, затем --ops раз выполняется каждая
+операция; печатается среднее время в микросекундах. Последний столбец - поиск по возрасту после всех
+изменений (в нем вливаются ключи, накопленные записями).
+"""
+
+import argparse
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+
+from pr_16_5_Jinja import User
+from user_repository import UserRepository
+
+
+def fill(size: int) -> UserRepository:
+    users = UserRepository(User)
+    users.create_many([(f'user{i:07d}', 18 + i % 80) for i in range(size)])
+    users.search(age_min=18, limit=1)       # вливаем ключи загрузки, чтобы замер их не включал
+    users.search(prefix='user', limit=1)
+    return users
+
+
+def per_op(operation, ops: int) -> float:
+    start = time.perf_counter()
+    for i in range(ops):
+        operation(i)
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000])
+    parser.add_argument('--ops', type=int, default=2000, help='операций каждого вида на один размер')
+    args = parser.parse_args()
+
+    print(f'{"users":>10} {"create us":>10} {"update us":>10} {"delete us":>10} {"search us":>10}')
+    for size in args.sizes:
+        users = fill(size)
+        step = max(1, size // args.ops)
+        create = per_op(lambda i: users.create(f'new{i}', 30), args.ops)
+        update = per_op(lambda i: users.update(1 + i * step, f'renamed{i}', 31), args.ops)
+        delete = per_op(lambda i: users.delete(2 + i * step), args.ops)
+        search = per_op(lambda i: users.search(age_min=40, age_max=41, limit=50), 100)
+        print(f'{size:>10} {create:>10.1f} {update:>10.1f} {delete:>10.1f} {search:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
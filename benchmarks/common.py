@@ -0,0 +1,22 @@
+"""Общие помощники бенчмарков: перцентили и печать таблиц."""
+
+import math
+from typing import Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    # values должны быть отсортированы; q - от 0 до 100, ближайший ранг
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+    }
@@ -0,0 +1,146 @@
+"""
+Лента изменений пользователей (create / update / delete) для GET /users/events в pr_16_5_Jinja.py.
+
+Хранилище (UserRepository, параметр feed) публикует каждое изменение с порядковым номером seq.
+Клиент подписывается через Server-Sent Events и правит свой список на месте, вместо того чтобы
+опрашивать "/" и получать всю страницу заново.
+
+- события нумеруются подряд, номер уходит клиенту в поле id: SSE вместе с меткой запуска сервера
+  ("<boot>-<seq>"), чтобы номер из прошлого запуска не приняли за номер текущего;
+- последние history событий хранятся в кольцевом буфере: клиент, переподключившись с заголовком
+  Last-Event-ID (браузерный EventSource шлет его сам) или ?since=, получает пропущенное. В ?since=
+  подходит и полный id ("<boot>-<seq>"), и голый номер <seq>: он считается номером текущего запуска
+  (номер больше текущего - из прошлого запуска - дает reset);
+- у каждого подписчика своя очередь на queue_size событий. Медленный клиент не держит память сервера:
+  при переполнении он получает событие reset и отключается; после reset клиент перечитывает список целиком
+  и подписывается заново. То же событие приходит, если нужных событий в буфере уже нет;
+- раз в HEARTBEAT_SECONDS при отсутствии событий отправляется комментарий-пинг, чтобы прокси не
+  закрывали соединение и отключившийся клиент обнаруживался.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import AsyncIterator, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+HISTORY_SIZE = 10_000
+QUEUE_SIZE = 1_000
+HEARTBEAT_SECONDS = 15.0
+
+
+class _Subscriber:
+    __slots__ = ("loop", "queue", "overflowed")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def deliver(self, event: tuple) -> None:
+        # выполняется в потоке event loop подписчика
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class ChangeFeed:
+    def __init__(self, history: int = HISTORY_SIZE, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.seq = 0
+        self.boot = os.urandom(4).hex()
+        self._history: deque = deque(maxlen=history)     # (seq, op, данные)
+        self._subscribers: List[_Subscriber] = []
+        self._lock = threading.Lock()       # изменения хранилища могут приходить из пула потоков
+
+    def publish(self, op: str, data: dict) -> None:
+        with self._lock:
+            self.seq += 1
+            event = (self.seq, op, data)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for subscriber in subscribers:
+            if subscriber.loop is current:
+                subscriber.deliver(event)
+            else:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+
+    def subscribe(self, since: Optional[int] = None):
+        # Возвращает (подписчик, пропущенные события, можно ли продолжить с since).
+        # Регистрация и снимок истории под одной блокировкой: событие не потеряется и не придет дважды.
+        subscriber = _Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            if since is None or since >= self.seq:
+                return subscriber, [], since is None or since == self.seq
+            oldest = self._history[0][0] if self._history else self.seq + 1
+            if since + 1 < oldest:
+                return subscriber, [], False
+            return subscriber, [event for event in self._history if event[0] > since], True
+
+    def unsubscribe(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def parse_since(self, last_event_id: Optional[str]) -> Optional[int]:
+        # "<boot>-<seq>" из Last-Event-ID или ?since=, голый "<seq>" - номер текущего запуска;
+        # чужой запуск или мусор дают -1, и клиент получит reset
+        if last_event_id is None:
+            return None
+        if last_event_id.isdecimal():
+            return int(last_event_id)
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self.boot or not seq.isdecimal():
+            return -1
+        return int(seq)
+
+    def event(self, seq: int, op: str, data: dict) -> bytes:
+        return f"id: {self.boot}-{seq}\nevent: {op}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+    def reset(self) -> bytes:
+        # id - текущий номер: перечитав список, клиент продолжит с него
+        return f"id: {self.boot}-{self.seq}\nevent: reset\ndata: {{}}\n\n".encode()
+
+
+async def _stream(feed: ChangeFeed, since: Optional[int]) -> AsyncIterator[bytes]:
+    subscriber, backlog, resumed = feed.subscribe(since)
+    try:
+        yield b"retry: 3000\n\n"
+        if not resumed:
+            yield feed.reset()
+        for event in backlog:
+            yield feed.event(*event)
+        while True:
+            if subscriber.overflowed:
+                # очередь все равно устарела: клиент перечитает список целиком
+                yield feed.reset()
+                return
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            yield feed.event(*event)
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+def event_stream_response(feed: ChangeFeed, last_event_id: Optional[str] = None) -> StreamingResponse:
+    since = feed.parse_since(last_event_id)
+    return StreamingResponse(_stream(feed, since), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,99 @@
+"""
+Объединение одновременных запросов на запись в пакеты (write coalescing) для POST /users в pr_16_4_pydantic.py.
+
+Каждый POST создает одного пользователя, но под нагрузкой их приходят сотни одновременно. Вместо
+сотни отдельных операций хранилища (блокировка, рост версии, запись в журнал, а в SQLite - транзакция
+с COMMIT на каждую) запросы ставятся в очередь и применяются одним пакетом:
+
+    creates = WriteCoalescer(users.create_each)
+    new_user = await creates.submit((username, age))
+
+- пакет собирается за window секунд после первого запроса (USERS_COALESCE_MS, по умолчанию 0 -
+  до следующей итерации event loop: задержки без нагрузки нет, а под нагрузкой в пакет попадает все,
+  что пришло за итерацию) или пока не наберется max_batch элементов;
+- apply получает список элементов и возвращает результат на каждый: запись или исключение, которое
+  submit поднимет у своего запроса (UsernameTaken остается ответом 400 только этого запроса);
+- пока пакет асинхронного хранилища (SQLite) выполняется, следующие запросы копятся и уходят
+  следующим пакетом сразу после него (group commit). Пакеты не перекрываются и применяются по порядку:
+  набранные max_batch элементов тоже ждут текущий пакет;
+- если клиент отключился до отправки пакета, его элемент в пакет не попадает.
+"""
+
+import asyncio
+import inspect
+import os
+from typing import Callable, List, Optional
+
+WINDOW_SECONDS = float(os.getenv('USERS_COALESCE_MS', '0')) / 1000
+MAX_BATCH = 512
+
+
+class WriteCoalescer:
+    def __init__(self, apply: Callable[[List], object], window: float = WINDOW_SECONDS, max_batch: int = MAX_BATCH):
+        self.apply = apply
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._pending: List[tuple] = []        # (элемент, future запроса)
+        self._handle: Optional[asyncio.Handle] = None
+        self._in_flight: Optional[asyncio.Task] = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._handle is None and self._in_flight is None:
+            self._handle = loop.call_later(self.window, self._flush) if self.window > 0 else loop.call_soon(self._flush)
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        # Пакеты применяются строго по одному и по порядку: пока асинхронный пакет выполняется, очередь
+        # (даже полная) ждет его и уходит из _finish. Пакет - не больше max_batch элементов
+        while self._pending and self._in_flight is None:
+            batch = [entry for entry in self._pending[:self.max_batch] if not entry[1].cancelled()]
+            del self._pending[:self.max_batch]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.apply([item for item, _ in batch])
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+            if inspect.isawaitable(results):
+                self._in_flight = asyncio.ensure_future(self._finish(batch, results))
+            else:
+                self._deliver(batch, results)
+
+    async def _finish(self, batch: List[tuple], results) -> None:
+        try:
+            self._deliver(batch, await results)
+        except Exception as e:
+            self._fail(batch, e)
+        finally:
+            if self._in_flight is asyncio.current_task():
+                self._in_flight = None
+            if self._pending:
+                self._flush()
+
+    @staticmethod
+    def _deliver(batch: List[tuple], results: List) -> None:
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: List[tuple], error: Exception) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
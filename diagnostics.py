@@ -0,0 +1,201 @@
+"""
+Диагностика живого экземпляра pr_16_5_Jinja.py по запросу: профиль CPU, снимки памяти tracemalloc
+и задержка event loop. Только для администратора и только когда включено.
+
+install_diagnostics(app, gauges) вызывается в конце модуля. Маршруты появляются, только если задан
+ADMIN_TOKEN, и требуют заголовок X-Admin-Token с тем же значением (иначе 403). Без ADMIN_TOKEN маршрутов
+нет совсем, а с ним ничего не работает в фоне: профилировщик, tracemalloc и замер задержки запускаются
+запросом и останавливаются вместе с ним (tracemalloc - запросом DELETE /admin/memory).
+
+    GET /admin/profile?seconds=5                 - выборочный профиль всех потоков за seconds секунд:
+                                                   стеки раз в interval_ms, текст "f1;f2;f3 число" для
+                                                   flamegraph.pl / speedscope;
+    GET /admin/profile?seconds=5&format=pstats   - cProfile потока event loop за seconds секунд, файл
+                                                   для pstats / snakeviz (рендер в пуле потоков не попадет);
+    POST /admin/memory/snapshots                 - снимок tracemalloc (первый запускает трассировку
+                                                   с frames кадрами стека), занятая память и gauges;
+    GET /admin/memory/diff?base=1&head=2         - что выросло между снимками: top мест по разнице размера,
+                                                   match оставляет файлы с подстрокой (user_repository.py);
+    DELETE /admin/memory                         - остановить tracemalloc и забыть снимки;
+    GET /admin/loop?seconds=1                    - задержка event loop: насколько позже срока просыпается
+                                                   sleep(interval_ms), p50 / p99 / max и число задач.
+
+Одновременно идет только один профиль (409 на второй): в процессе может быть лишь один cProfile.
+gauges - функция, которая возвращает размеры кэшей и хранилища для снимков памяти.
+"""
+
+import asyncio
+import cProfile
+import marshal
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Literal, Optional, Union
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+MAX_SECONDS = 60
+MAX_SNAPSHOTS = 8       # старые снимки вытесняются: каждый держит копию всех трасс
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    # Выборочный профиль: стеки всех потоков, кроме своего, раз в interval секунд.
+    # Свернутый стек "поток;внешняя функция;...;текущая функция" -> число выборок
+    me = threading.get_ident()
+    stacks = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+async def profile_loop(seconds: float) -> bytes:
+    # cProfile включается в потоке event loop и видит все корутины, которые выполнятся за seconds секунд.
+    # Результат - то же, что пишет Profile.dump_stats: marshal словаря stats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+async def loop_lag(seconds: float, interval: float) -> dict:
+    loop = asyncio.get_running_loop()
+    lags = []
+    end = loop.time() + seconds
+    while loop.time() < end:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - start - interval))
+    lags.sort()
+    pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+    return {"samples": len(lags), "interval_ms": interval * 1000, "p50_ms": round(pick(0.5), 3),
+            "p99_ms": round(pick(0.99), 3), "max_ms": round(lags[-1] * 1000, 3), "tasks": len(asyncio.all_tasks())}
+
+
+class MemoryTracer:
+    def __init__(self, gauges: Optional[Callable[[], Dict[str, int]]] = None, max_snapshots: int = MAX_SNAPSHOTS):
+        self.gauges = gauges or dict
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[int, tuple]" = OrderedDict()     # id -> (снимок, gauges)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def take(self, frames: int) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        gauges = self.gauges()
+        with self._lock:
+            snapshot_id, self._next_id = self._next_id, self._next_id + 1
+            self._snapshots[snapshot_id] = (snapshot, gauges)
+            if len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        traced, peak = tracemalloc.get_traced_memory()
+        return {"id": snapshot_id, "traced_bytes": traced, "peak_bytes": peak,
+                "frames": tracemalloc.get_traceback_limit(), "gauges": gauges, "snapshots": list(self._snapshots)}
+
+    def diff(self, base: int, head: int, group: str, limit: int, match: str = "") -> dict:
+        with self._lock:
+            if base not in self._snapshots or head not in self._snapshots:
+                raise KeyError(base if base not in self._snapshots else head)
+            (old, old_gauges), (new, new_gauges) = self._snapshots[base], self._snapshots[head]
+        if match:
+            only = (tracemalloc.Filter(True, f"*{match}*", all_frames=True),)
+            old, new = old.filter_traces(only), new.filter_traces(only)
+        stats = new.compare_to(old, group)
+        top = [{"where": stat.traceback.format() if group == "traceback" else str(stat.traceback[0]),
+                "size_diff": stat.size_diff, "size": stat.size,
+                "count_diff": stat.count_diff, "count": stat.count} for stat in stats[:limit]]
+        return {"base": base, "head": head, "size_diff": sum(stat.size_diff for stat in stats),
+                "gauges": {key: {"base": old_gauges.get(key), "head": value} for key, value in new_gauges.items()},
+                "top": top}
+
+    def stop(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+        tracemalloc.stop()
+
+
+def _require_admin(token: str):
+    async def require_admin(x_admin_token: Optional[str] = Header(None)):
+        if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode(), token.encode()):
+            raise HTTPException(status_code=403, detail="Нужен заголовок X-Admin-Token")
+    return require_admin
+
+
+def install_diagnostics(app: Union[FastAPI, APIRouter], gauges: Optional[Callable[[], Dict[str, int]]] = None,
+                        token: str = ADMIN_TOKEN) -> Optional[MemoryTracer]:
+    if not token:
+        return None
+    tracer = MemoryTracer(gauges)
+    profiling = asyncio.Lock()
+    # маршруты прямо в app, как /metrics: service.py переносит их в /jinja вместе с проверкой токена
+    admin = [Depends(_require_admin(token))]
+
+    @app.get("/admin/profile", dependencies=admin, include_in_schema=False)
+    async def profile(seconds: float = Query(5, gt=0, le=MAX_SECONDS),
+                      format: Literal["collapsed", "pstats"] = "collapsed",
+                      interval_ms: float = Query(10, ge=1, le=1000)):
+        if profiling.locked():
+            raise HTTPException(status_code=409, detail="Профиль уже снимается")
+        async with profiling:
+            if format == "pstats":
+                return Response(await profile_loop(seconds), media_type="application/octet-stream",
+                                headers={"Content-Disposition": 'attachment; filename="profile.pstats"'})
+            stacks = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000)
+        return PlainTextResponse(collapsed(stacks))
+
+    @app.post("/admin/memory/snapshots", dependencies=admin, include_in_schema=False)
+    async def memory_snapshot(frames: int = Query(1, ge=1, le=64)):
+        return await asyncio.to_thread(tracer.take, frames)
+
+    @app.get("/admin/memory/diff", dependencies=admin, include_in_schema=False)
+    async def memory_diff(base: int, head: int, group: Literal["lineno", "filename", "traceback"] = "lineno",
+                          limit: int = Query(25, ge=1, le=1000), match: str = ""):
+        try:
+            return await asyncio.to_thread(tracer.diff, base, head, group, limit, match)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=f"Снимок {e.args[0]} не найден")
+
+    @app.delete("/admin/memory", dependencies=admin, include_in_schema=False)
+    async def memory_stop():
+        tracer.stop()
+        return {"detail": "tracemalloc остановлен"}
+
+    @app.get("/admin/loop", dependencies=admin, include_in_schema=False)
+    async def loop(seconds: float = Query(1, gt=0, le=MAX_SECONDS), interval_ms: float = Query(10, ge=1, le=1000)):
+        return await loop_lag(seconds, interval_ms / 1000)
+
+    return tracer
@@ -0,0 +1,228 @@
+"""
+Метрики запросов для приложений pr_16_1 ... pr_16_5 в формате Prometheus (GET /metrics).
+
+install_metrics(app) вызывается сразу после app = FastAPI(), до объявления маршрутов, и подключает:
+    - MetricsMiddleware (чистый ASGI, без BaseHTTPMiddleware): число запросов по маршруту/методу/статусу,
+      гистограмма длительности, запросы "в полете", размеры тела запроса и ответа;
+    - TimedRoute - класс маршрутов, который делит время запроса на фазы:
+        validation    - от входа в маршрут до вызова функции-обработчика (разбор тела, проверка параметров);
+        handler       - работа самой функции-обработчика;
+        serialization - от возврата из обработчика до готового Response (response_model, JSON);
+        render        - рендеринг шаблонов Jinja (user_pages.py), входит в handler;
+    - маршрут GET /metrics.
+
+Метка route - шаблон пути ("/users/{user_id}"), а не сам путь, чтобы число рядов не росло с числом id.
+На запрос приходится несколько вызовов perf_counter и обновлений словарей - это можно держать
+включенным в продакшене (см. benchmarks/bench_metrics_overhead.py).
+"""
+
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+ROUTE_KEY = "metrics.route"
+
+_marks: ContextVar[Optional[Dict[str, float]]] = ContextVar("metrics_marks", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # последняя ячейка - больше всех границ (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        out, total = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            out.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum}")
+        out.append(f"{name}_count{{{labels}}} {self.count}")
+        return out
+
+
+class Metrics:
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.phases: Dict[Tuple[str, str, str], Histogram] = {}
+        self.request_size: Dict[Tuple[str, str], Histogram] = {}
+        self.response_size: Dict[Tuple[str, str], Histogram] = {}
+        self.in_flight = 0
+
+    @staticmethod
+    def _histogram(table: dict, key: tuple, buckets: Tuple[float, ...]) -> Histogram:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, received: int, sent: int):
+        key = (method, route)
+        self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+        self._histogram(self.latency, key, LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.request_size, key, SIZE_BUCKETS).observe(received)
+        self._histogram(self.response_size, key, SIZE_BUCKETS).observe(sent)
+
+    def observe_phase(self, method: str, route: str, phase: str, seconds: float) -> None:
+        self._histogram(self.phases, (method, route, phase), LATENCY_BUCKETS).observe(seconds)
+
+    def render(self) -> str:
+        lines = ["# HELP http_requests_total Number of HTTP requests.", "# TYPE http_requests_total counter"]
+        for (method, route, status), count in self.requests.items():
+            lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        lines += ["# HELP http_requests_in_flight Requests being processed now.",
+                  "# TYPE http_requests_in_flight gauge",
+                  f"http_requests_in_flight {self.in_flight}"]
+        for name, help_text, table in (
+                ("http_request_duration_seconds", "Request latency.", self.latency),
+                ("http_request_size_bytes", "Request body size.", self.request_size),
+                ("http_response_size_bytes", "Response body size.", self.response_size)):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (method, route), histogram in table.items():
+                lines += histogram.lines(name, f'method="{method}",route="{route}"')
+        lines += ["# HELP http_request_phase_seconds Time spent in validation, handler, serialization and render.",
+                  "# TYPE http_request_phase_seconds histogram"]
+        for (method, route, phase), histogram in self.phases.items():
+            lines += histogram.lines("http_request_phase_seconds", f'method="{method}",route="{route}",phase="{phase}"')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = self.metrics
+        sizes = [0, 0]      # принято байт, отправлено байт
+        status = [500]
+
+        async def counting_receive():
+            message = await receive()
+            sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            metrics.in_flight -= 1
+            metrics.observe_request(scope["method"], scope.get(ROUTE_KEY, "unmatched"), status[0],
+                                    time.perf_counter() - start, sizes[0], sizes[1])
+
+
+@contextmanager
+def timed(phase: str):
+    # Засекает фазу внутри обработчика (например, render); вне запроса ничего не делает
+    marks = _marks.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if marks is not None:
+            marks[phase] = marks.get(phase, 0.0) + time.perf_counter() - start
+
+
+def _timed_endpoint(endpoint):
+    # Обертка отмечает начало и конец работы функции-обработчика. wraps сохраняет сигнатуру (__wrapped__),
+    # по которой FastAPI находит параметры пути, запроса и тела.
+    if inspect.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            marks = _marks.get()
+            if marks is not None:
+                marks["start"] = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if marks is not None:
+                    marks["end"] = time.perf_counter()
+    else:
+        @wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            marks = _marks.get()
+            if marks is not None:
+                marks["start"] = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                if marks is not None:
+                    marks["end"] = time.perf_counter()
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    metrics: Metrics = None     # задается в install_metrics
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        self.unwrapped_endpoint = endpoint      # исходная функция - для переноса маршрута в другое приложение
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        metrics, route_path = self.metrics, self.path
+
+        async def timed_handler(request):
+            request.scope[ROUTE_KEY] = route_path
+            marks = {}
+            token = _marks.set(marks)
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                finish = time.perf_counter()
+                _marks.reset(token)
+                if metrics is not None and "start" in marks:
+                    method = request.method
+                    metrics.observe_phase(method, route_path, "validation", marks["start"] - start)
+                    metrics.observe_phase(method, route_path, "handler", marks["end"] - marks["start"])
+                    metrics.observe_phase(method, route_path, "serialization", finish - marks["end"])
+                    if "render" in marks:
+                        metrics.observe_phase(method, route_path, "render", marks["render"])
+
+        return timed_handler
+
+
+def install_metrics(app: FastAPI) -> Metrics:
+    metrics = Metrics()
+    app.state.metrics = metrics
+    # у каждого приложения свои метрики, поэтому и класс маршрута свой
+    app.router.route_class = type("TimedRoute", (TimedRoute,), {"metrics": metrics})
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def get_metrics():
+        return metrics.render()
+
+    return metrics
@@ -0,0 +1,153 @@
+"""
+Быстрая проверка параметров пути с ограничениями Annotated[..., Path(...)] и ответ 422 без pydantic.
+
+FastAPI на каждый некорректный запрос проходит всю цепочку зависимостей, собирает ValidationError
+и кодирует ее через jsonable_encoder. Для мусорного трафика (/user/User123/5 в pr_16_2_path.py) это
+заметная доля CPU. install_fast_reject(app) вызывается в конце модуля приложения, после объявления
+маршрутов, и для каждого маршрута с параметрами пути:
+    - берет ограничения из метаданных параметров (min_length, max_length, pattern/regex, ge, gt, le, lt);
+    - получает для них валидатор из общего реестра: одинаковые ограничения в разных приложениях
+      (regex="^[a-zA-Z0-9_-]+$" в update_user pr_16_4 и pr_16_5) дают один объект с одним
+      скомпилированным re;
+    - ставит перед маршрутом проверку, которая при явной ошибке сразу отвечает 422.
+
+Тело ответа совпадает с тем, что вернул бы FastAPI (type, loc, msg, input, ctx, тот же порядок ошибок).
+Отклоняем только то, в чем уверены: число вида "+5", " 5" или "5.0" pydantic принимает, поэтому
+такие значения проверяются обычным путем. Корректные запросы проходят дальше без изменений.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import Response
+from fastapi.routing import APIRoute, request_response
+
+from metrics import ROUTE_KEY
+from response_cache import encode_json
+
+_DIGITS = re.compile(r"[0-9]{1,18}")
+_ANY_DIGIT = re.compile(r"[0-9]")
+UNSURE = object()       # значение, которое решает pydantic
+
+
+class PathValidator:
+    __slots__ = ("kind", "min_length", "max_length", "pattern", "regex", "ge", "gt", "le", "lt")
+
+    def __init__(self, kind: type, min_length=None, max_length=None, pattern=None, ge=None, gt=None, le=None, lt=None):
+        self.kind = kind
+        self.min_length, self.max_length = min_length, max_length
+        self.pattern = pattern
+        self.regex = re.compile(pattern) if pattern is not None else None
+        self.ge, self.gt, self.le, self.lt = ge, gt, le, lt
+
+    def error(self, value: str):
+        # None - значение корректно, UNSURE - пусть решает pydantic, иначе (type, msg, ctx)
+        if self.kind is int:
+            return self._int_error(value)
+        if self.min_length is not None and len(value) < self.min_length:
+            return ("string_too_short", f"String should have at least {self.min_length} "
+                    f"character{'' if self.min_length == 1 else 's'}", {"min_length": self.min_length})
+        if self.max_length is not None and len(value) > self.max_length:
+            return ("string_too_long", f"String should have at most {self.max_length} "
+                    f"character{'' if self.max_length == 1 else 's'}", {"max_length": self.max_length})
+        if self.regex is not None and self.regex.search(value) is None:
+            return ("string_pattern_mismatch", f"String should match pattern '{self.pattern}'",
+                    {"pattern": self.pattern})
+        return None
+
+    def _int_error(self, value: str):
+        if not _DIGITS.fullmatch(value):
+            if _ANY_DIGIT.search(value) is None:    # ни одной цифры - целым это не станет ни при каком разборе
+                return "int_parsing", "Input should be a valid integer, unable to parse string as an integer", None
+            return UNSURE
+        number = int(value)
+        if self.gt is not None and not number > self.gt:
+            return "greater_than", f"Input should be greater than {self.gt}", {"gt": self.gt}
+        if self.ge is not None and not number >= self.ge:
+            return "greater_than_equal", f"Input should be greater than or equal to {self.ge}", {"ge": self.ge}
+        if self.lt is not None and not number < self.lt:
+            return "less_than", f"Input should be less than {self.lt}", {"lt": self.lt}
+        if self.le is not None and not number <= self.le:
+            return "less_than_equal", f"Input should be less than or equal to {self.le}", {"le": self.le}
+        return None
+
+
+# Общий реестр: ключ - тип и набор ограничений
+_registry: Dict[tuple, PathValidator] = {}
+
+
+def path_validator(kind: type, **constraints) -> PathValidator:
+    key = (kind, *sorted(constraints.items()))
+    validator = _registry.get(key)
+    if validator is None:
+        validator = _registry[key] = PathValidator(kind, **constraints)
+    return validator
+
+
+def _constraints(metadata) -> dict:
+    found = {}
+    for item in metadata:
+        for name in ("min_length", "max_length", "pattern", "ge", "gt", "le", "lt"):
+            value = getattr(item, name, None)
+            if value is not None:
+                found[name] = value
+    return found
+
+
+def route_validators(route: APIRoute) -> List[Tuple[str, str, PathValidator]]:
+    # (имя в пути, имя в ответе об ошибке, валидатор) - в порядке, в котором FastAPI проверяет параметры
+    checks = []
+    for param in route.dependant.path_params:
+        kind = param.field_info.annotation
+        if kind not in (int, str):
+            continue
+        constraints = _constraints(param.field_info.metadata)
+        if kind is str and not constraints:
+            continue        # любая строка подходит
+        checks.append((param.alias, param.alias, path_validator(kind, **constraints)))
+    return checks
+
+
+def _rejection(checks, path_params: dict) -> Optional[bytes]:
+    errors = []
+    for key, name, validator in checks:
+        value = path_params.get(key)
+        if not isinstance(value, str):
+            return None
+        problem = validator.error(value)
+        if problem is UNSURE:
+            return None
+        if problem is not None:
+            error_type, message, ctx = problem
+            error = {"type": error_type, "loc": ["path", name], "msg": message, "input": value}
+            if ctx is not None:
+                error["ctx"] = ctx
+            errors.append(error)
+    return encode_json({"detail": errors}) if errors else None
+
+
+def _fast_reject(get_route_handler, route_path: str, checks):
+    # Проверка ставится на уровне get_route_handler, а не route.app: FastAPI строит обработчик заново,
+    # когда маршрут попадает в другое приложение через include_router (см. service.py)
+    def guarded_route_handler():
+        handler = get_route_handler()
+
+        async def guarded(request):
+            body = _rejection(checks, request.path_params)
+            if body is None:
+                return await handler(request)
+            request.scope[ROUTE_KEY] = route_path
+            return Response(body, status_code=422, media_type="application/json")
+        return guarded
+    return guarded_route_handler
+
+
+def install_fast_reject(app: Union[FastAPI, APIRouter]) -> None:
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route, "fast_reject", False):
+            checks = route_validators(route)
+            if checks:
+                route.get_route_handler = _fast_reject(route.get_route_handler, route.path, checks)
+                route.app = request_response(route.get_route_handler())
+                route.fast_reject = True
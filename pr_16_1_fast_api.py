@@ -1,27 +1,34 @@
 from fastapi import FastAPI, Query
+from metrics import install_metrics
+from response_cache import ResponseCache
 
 # Создаем экземпляр приложения FastAPI
 app = FastAPI()
+install_metrics(app)  # GET /metrics: задержки, счетчики и размеры запросов по маршрутам
+
+# Готовые JSON-байты ответов по ключу (маршрут, параметры): LRU + TTL + ограничение по памяти
+cache = ResponseCache()
 
 
 # Маршрут к главной странице - "/"
 @app.get('/')
 def home_page():
-    return {"message": 'Главная страница'}
+    return cache.json(("/",), lambda: {"message": 'Главная страница'})
 
 
 # Маршрут к странице администратора - "/user/admin": http://127.0.0.1:8000/user/admin
 @app.get("/user/admin")
 def get_admin():
-    return {"message": "Вы вошли как администратор"}
+    return cache.json(("/user/admin",), lambda: {"message": "Вы вошли как администратор"})
 
 
 # Маршрут к страницам пользователей с передачей данных в адресной строке - "/user":
 # http://127.0.0.1:8000/user?username=%27Oleg%27&age=58
+# Ответ - эхо параметров клиента, их сочетаний бесконечно много: в кэш не кладем, иначе случайные запросы
+# вытеснили бы из LRU ответы /user/{user_id}
 @app.get('/user')
 async def get_user_info(username: str = Query(...), age: int = Query(...)):
-    user_info = {"username": username, "age": age}
-    return user_info
+    return {"username": username, "age": age}
 
 
 @app.get("/user")
@@ -50,8 +57,27 @@ users = {
 
 @app.get("/user/{user_id}")
 async def get_user(user_id: int):
+    if user_id not in users:
+        return user_message(user_id)    # промахи не кэшируем: перебор несуществующих id не вытеснит нужные ответы
+    return cache.json(("/user/{user_id}", user_id), lambda: user_message(user_id))
+
+
+def user_message(user_id: int) -> dict:
     user = users.get(user_id)
     if user:
         return {"message": f"Информация о пользователе. ID: {user_id}, Имя: {user['username']}, Возраст: {user['age']}"}
     else:
         return {"message": "Пользователь не найден"}
+
+
+# Изменять users нужно через эти функции: они сбрасывают закэшированный ответ пользователя,
+# иначе до истечения TTL отдавался бы старый текст
+
+def set_user(user_id: int, username: str, age: int) -> None:
+    users[user_id] = {"username": username, "age": age}
+    cache.invalidate("/user/{user_id}", user_id)
+
+
+def remove_user(user_id: int) -> None:
+    users.pop(user_id, None)
+    cache.invalidate("/user/{user_id}", user_id)
@@ -1,7 +1,10 @@
 from typing import Annotated
 from fastapi import FastAPI, Path
+from metrics import install_metrics
+from path_validators import install_fast_reject
 
 app = FastAPI()
+install_metrics(app)  # GET /metrics: задержки, счетчики и размеры запросов по маршрутам
 
 
 @app.get('/user/{user_id}')
@@ -73,3 +76,6 @@ async def get_user(
         "age": age,
         "message": f"Вы вошли как пользователь {username} возрастом {age} лет"
     }
+
+# последней строкой после маршрутов: явные ошибки в параметрах пути отклоняются с 422 до pydantic
+install_fast_reject(app)
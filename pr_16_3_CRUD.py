@@ -1,16 +1,36 @@
-from typing import Annotated
-from fastapi import FastAPI, Path, HTTPException
+from typing import Annotated, Optional
+from fastapi import FastAPI, Path, HTTPException, Query, Response
+from admission import WRITE_METHODS
+from metrics import install_metrics
+from sqlite_repository import BACKEND, SQLiteRecords, sqlite_path
+from user_api import MAX_PAGE_SIZE, page_response, resolve
+from user_repository import UserRecords
+from user_storage import install_group_commit, open_storage
 
 app = FastAPI()
+install_metrics(app)  # GET /metrics: задержки, счетчики и размеры запросов по маршрутам
 
-users = {'1': 'Имя: Example, возраст: 18'}
+if BACKEND == "sqlite":
+    storage = None
+    users = SQLiteRecords(sqlite_path("crud"), {'1': 'Имя: Example, возраст: 18'})
+else:
+    storage = open_storage("crud")
+    users = UserRecords({'1': 'Имя: Example, возраст: 18'}, storage=storage)  # dict с постоянным счетчиком id
 
 
 # get запрос по маршруту '/users', который возвращает словарь users
+# (или его страницу: ?limit=100&cursor=<id последнего пользователя>, курсор следующей страницы - в X-Next-Cursor)
 
 @app.get('/users')
-async def get_users():
-    return users
+async def get_users(
+        response: Response,
+        limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE, description="Размер страницы")] = None,
+        cursor: Annotated[Optional[int], Query(ge=0, description="id последнего пользователя предыдущей страницы")] = None
+):
+    if limit is None and cursor is None:
+        return await resolve(users.as_dict())
+    page, next_cursor = await resolve(users.page(cursor, limit))
+    return page_response(response, page, next_cursor)
 
 
 # написать post запрос по маршруту '/user/{username}/{age}', который добавляет в словарь по макс значению ключей
@@ -18,8 +38,7 @@ async def get_users():
 
 @app.post('/users/{username}/{age}')
 async def post_user(username: str, age: int):
-    user_id = str(max(int(key) for key in users.keys()) + 1) if users else '1'
-    users[user_id] = f'Имя: {username}, возраст: {age}'
+    user_id = await resolve(users.add(f'Имя: {username}, возраст: {age}'))  # id из счетчика, без перебора ключей
     return f'User {user_id}, {username} is registered'
 
 # Вариант, если надо добавить несколько записей
@@ -36,8 +55,7 @@ async def post_user(username: str, age: int):
 
 @app.put('/users/{user_id}')
 async def update_user(user_id: str, username: str, age: int):
-    if user_id in users.keys():
-        users[user_id] = f'Имя: {username}, возраст: {age}'
+    if await resolve(users.set(user_id, f'Имя: {username}, возраст: {age}')):
         return f"The user {user_id} with {username} & {age} is updated"
     else:
         raise HTTPException(status_code=404, detail=f'user: {user_id}, {username} не найдена')
@@ -48,13 +66,15 @@ async def update_user(user_id: str, username: str, age: int):
 
 @app.delete('/users/{user_id}')
 async def delete_user(user_id: str):
-    if user_id in users:
-        del_user = users[user_id]
-        del users[user_id]
+    del_user = await resolve(users.delete(user_id))
+    if del_user is not None:
         return {"detail": f"User_id: {user_id} {del_user} удален"}
     else:
         raise HTTPException(status_code=404, detail=f"User {user_id} не найден")
 
+# с журналом (USERS_DATA_DIR) запись отвечает после fsync своего изменения, одним fsync на одновременные запросы
+install_group_commit(app, storage, WRITE_METHODS)
+
 # @app.delete('/users/{user_id}')
 # async def delete_user(user_id: str):
 #     if users.get(user_id):   # !работает только со списками словарей и показывает и проверяет значение ключа, не ключ!
@@ -7,17 +7,55 @@ class User(BaseModel):
     age: int
 
 
-from typing import List
-from fastapi import FastAPI, HTTPException
+from typing import Annotated, List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from admission import WRITE_METHODS, install_admission
+from coalescer import WriteCoalescer
+from metrics import install_metrics
+from path_validators import install_fast_reject
+from sqlite_repository import BACKEND, SQLiteUserRepository, sqlite_path
+from user_api import (FAST_JSON, MAX_PAGE_SIZE, decode_cursor, encode_cursor, encoded_page_response, export_response,
+                      page_response, parse_fields, resolve, user_response)
+from user_repository import InvalidCursor, UserRepository, UsernameTaken
+from user_storage import install_group_commit, open_storage
 
-users: List[User] = []
+if BACKEND == "sqlite":
+    storage = None
+    users = SQLiteUserRepository(User, sqlite_path("pydantic"))
+else:
+    # индексы по id и username вместо списка List[User]; USERS_DATA_DIR включает журнал на диске (user_storage.py)
+    storage = open_storage("pydantic")
+    users = UserRepository(User, fast_json=FAST_JSON, storage=storage)
+# одновременные POST создания пользователей применяются к хранилищу одним пакетом (coalescer.py).
+# users читается при каждом пакете: бенчмарки и тесты подменяют хранилище модуля
+creates = WriteCoalescer(lambda items: users.create_each(items))
 
 app = FastAPI()
+install_metrics(app)  # GET /metrics: задержки, счетчики и размеры запросов по маршрутам
 
 
 @app.get("/users", response_model=List[User])
-async def get_users():
-    return users
+async def get_users(
+        request: Request,
+        response: Response,
+        limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE, description="Размер страницы")] = None,
+        cursor: Annotated[Optional[int], Query(ge=0, description="id последнего пользователя предыдущей страницы")] = None,
+        fields: Annotated[Optional[str], Query(description="Поля через запятую, например id,username")] = None
+):
+    names = parse_fields(User, fields)
+    if names is None and getattr(users, "bodies", None) is not None:
+        # готовое тело страницы и его сжатые варианты из кэша хранилища в любом режиме fast_json
+        return await encoded_page_response(request, users, cursor, limit)
+    page, next_cursor = await resolve(users.page(cursor, limit))
+    return page_response(response, page, next_cursor, names, store=users)
+
+
+# Выгрузка всех пользователей потоком: NDJSON (по строке JSON на пользователя) или CSV
+@app.get("/users/export")
+async def export_users(
+        fmt: Annotated[Literal["ndjson", "csv"], Query(alias="format", description="ndjson или csv")] = "ndjson"
+):
+    return export_response(users, fmt)
 
 
 from pydantic import Field
@@ -36,14 +74,93 @@ class UserCreate(BaseModel):
         description="Enter Age")
 
 
+# Поиск по вторичным индексам хранилища: диапазон возраста и начало имени, без выгрузки всех пользователей.
+# Страница - обход одного индекса с места курсора до limit записей: с prefix результат идет по username,
+# только с возрастом - по (age, id), без условий - по id. Курсор следующей страницы - в X-Next-Cursor.
+@app.get("/users/search", response_model=List[User])
+async def search_users(
+        request: Request,
+        response: Response,
+        age_min: Annotated[Optional[int], Query(ge=0, description="Возраст от (включительно)")] = None,
+        age_max: Annotated[Optional[int], Query(ge=0, description="Возраст до (включительно)")] = None,
+        prefix: Annotated[Optional[str], Query(min_length=1, max_length=100, description="Начало username")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, description="Размер страницы")] = 100,
+        cursor: Annotated[Optional[str], Query(max_length=400, description="X-Next-Cursor предыдущей страницы")] = None,
+        fields: Annotated[Optional[str], Query(description="Поля через запятую, например id,username")] = None
+):
+    names = parse_fields(User, fields)
+    try:
+        page, next_key = await resolve(users.search(age_min, age_max, prefix, decode_cursor(cursor), limit))
+    except InvalidCursor:
+        raise HTTPException(status_code=422, detail="cursor получен для другого поиска")
+    return page_response(response, page, encode_cursor(next_key), names, store=users, request=request)
+
+
 @app.post("/users", response_model=User)
 async def create_user(user: UserCreate) -> User:    # переменная user, по которой FastAPI создает объект класса UserCreate
-    if any(u.username == user.username for u in users): # или альтернативно: if user.username in [u.username for u in users]:
+    try:
+        new_user = await creates.submit((user.username, user.age))
+    except UsernameTaken:   # уникальность проверяет индекс хранилища (в SQLite - уникальный индекс базы)
         raise HTTPException(status_code=400, detail="Username already exists")
-    new_id = max((u.id for u in users), default=0) + 1
-    new_user = User(id=new_id, username=user.username, age=user.age)
-    users.append(new_user)
-    return new_user
+    return user_response(users, new_user)
+
+
+# Пакетные операции для ночных импортов: один HTTP-запрос на весь пакет.
+# Тело проверяется целиком за один проход TypeAdapter(List[...]).validate_json, пакет применяется атомарно
+# (либо все элементы, либо ни одного), в ответе - результат по каждому элементу.
+
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+from user_repository import BatchRejected
+
+
+class UserUpdate(BaseModel):
+    id: int
+    username: str = Field(..., min_length=3, max_length=20, pattern="^[a-zA-Z0-9_-]+$")
+    age: int
+
+
+bulk_create_adapter = TypeAdapter(List[UserCreate])
+bulk_update_adapter = TypeAdapter(List[UserUpdate])
+bulk_delete_adapter = TypeAdapter(List[int])
+
+
+async def validate_batch(request: Request, adapter: TypeAdapter):
+    try:
+        return adapter.validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+
+async def batch_response(status: str, apply, size: int):
+    try:
+        done = await resolve(apply())
+    except BatchRejected as e:
+        results = [{"index": i, "status": "error", "detail": e.errors[i]} if i in e.errors
+                   else {"index": i, "status": "skipped"} for i in range(size)]
+        return JSONResponse({"applied": False, "results": results}, status_code=400)
+    results = [{"index": i, "status": status, "user": users.to_model(user).model_dump()} for i, user in enumerate(done)]
+    return {"applied": True, "results": results}
+
+
+@app.post("/users/bulk")
+async def create_users_bulk(request: Request):
+    items = await validate_batch(request, bulk_create_adapter)
+    return await batch_response("created", lambda: users.create_many([(u.username, u.age) for u in items]), len(items))
+
+
+@app.put("/users/bulk")
+async def update_users_bulk(request: Request):
+    items = await validate_batch(request, bulk_update_adapter)
+    return await batch_response("updated", lambda: users.update_many([(u.id, u.username, u.age) for u in items]),
+                                len(items))
+
+
+@app.delete("/users/bulk")  # объявлен раньше DELETE /users/{user_id}, иначе "bulk" попадет в user_id
+async def delete_users_bulk(request: Request):
+    user_ids = await validate_batch(request, bulk_delete_adapter)
+    return await batch_response("deleted", lambda: users.delete_many(user_ids), len(user_ids))
 
 #   Class User:
 # Описывает модель данных для ответа API (например, когда вы возвращаете данные пользователя).
@@ -87,7 +204,6 @@ async def create_user(user: UserCreate) -> User:    # переменная user,
 # В вашем коде переменная user — это объект класса UserCreate, который создается автоматически FastAPI на основе данных,
 # переданных в теле запроса (например, JSON). Этот объект имеет атрибуты класса UserCreate, такие как username и age.
 
-from typing import Annotated
 from fastapi import Path
 
 
@@ -110,12 +226,11 @@ async def create_user_(
             )
         ]
 ):
-    if any(u.username == username for u in users): # или альтернативно: if user.username in [u.username for u in users]:
+    try:
+        new_user = await creates.submit((username, age))
+    except UsernameTaken:
         raise HTTPException(status_code=400, detail="Username already exists")
-    new_id = max((u.id for u in users), default=0) + 1
-    new_user = User(id=new_id, username=username, age=age)
-    users.append(new_user)
-    return new_user
+    return user_response(users, new_user)
 
 
 @app.put('/users/{user_id}/{username}/{age}', response_model=User)
@@ -137,16 +252,15 @@ async def update_user(
         ],
         age: int
 ):
-    if users:
-        for user in users:
-            if user.id == user_id:  # в моей модели User полу называется id, а не user_id
-                user.username = username  # user[username] не правильно, так как не словарь, а объект и
-                # 'username' не правильно, тогда жестко задаю именно 'username', а надо передать параметр username
-                user.age = age
-                return user
-        else:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-    raise HTTPException(status_code=404, detail="Список пустой")
+    try:
+        user = await resolve(users.update(user_id, username, age))  # поиск по индексу id, а не перебором списка
+    except UsernameTaken:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    if user is None:
+        # пустое хранилище проверяем только при промахе, а не на каждом запросе
+        detail = "Пользователь не найден" if await resolve(users.count()) else "Список пустой"
+        raise HTTPException(status_code=404, detail=detail)
+    return user_response(users, user)
 
 # Логика с else внутри цикла - else должен быть на уровне for - всех проверить и только если нет, выбросить исключение
 # Вызов raise HTTPException внутри цикла с else приведет к тому, что исключение будет выброшено при первой же неудачной
@@ -154,12 +268,17 @@ async def update_user(
 
 @app.delete("/users/{user_id}", response_model=dict)
 async def delete_user(user_id: int):
-    for i, user in enumerate(users):
-        if user.id == user_id:
-            users.pop(i) # или del users[i] - удаление по индексу
-            return {"detail": f"Пользователь {user_id} удален"}
+    if await resolve(users.delete(user_id)) is not None:  # удаление из dict за O(1), без сдвига как в list.pop(i)
+        return {"detail": f"Пользователь {user_id} удален"}
     raise HTTPException(status_code=404, detail="Пользователь не найден")
 
+# последней строкой после маршрутов: явные ошибки в параметрах пути отклоняются с 422 до pydantic
+install_fast_reject(app)
+# запись (POST/PUT/DELETE) под перегрузкой: лимит одновременных запросов на маршрут и бюджет ожидания, 503/429
+install_admission(app)
+# с журналом (USERS_DATA_DIR) запись отвечает после fsync своего изменения, одним fsync на одновременные запросы
+install_group_commit(app, storage, WRITE_METHODS)
+
 # Метод remove в списках Python удаляет элемент по значению, а не по индексу. Вы передаете i (индекс), но remove
 # ожидает объект user. Это вызовет ошибку или некорректное поведение.
 #   Логика удаления:
@@ -3,11 +3,21 @@
 https://uguide.ru/tablica-osnovnykh-tegov-html-s-primerami
 """
 
-from fastapi import FastAPI, Request, HTTPException, Path
-from fastapi.templating import Jinja2Templates
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Request, HTTPException, Path, Query, Response
+from change_feed import ChangeFeed, event_stream_response
+from diagnostics import install_diagnostics
 from fastapi.responses import HTMLResponse
+from admission import WRITE_METHODS, install_admission
+from metrics import install_metrics
+from path_validators import install_fast_reject
 from pydantic import BaseModel, Field
-from typing import Annotated, List
+from typing import Annotated, List, Optional
+from user_api import (FAST_JSON, MAX_PAGE_SIZE, encoded_page_response, page_response, parse_fields, resolve,
+                      user_response)
+from user_pages import PageRenderer
+from user_repository import UserRepository, UsernameTaken
+from user_storage import install_group_commit, open_storage
 
 
 class User(BaseModel):
@@ -16,16 +26,38 @@ class User(BaseModel):
     age: int
 
 
-users: List[User] = []
+# индексы по id и username вместо списка List[User]; USERS_DATA_DIR включает журнал на диске (user_storage.py)
+# feed - лента изменений для GET /users/events
+storage = open_storage("jinja")
+users = UserRepository(User, fast_json=FAST_JSON, storage=storage, feed=ChangeFeed())
 
-app = FastAPI()
+pages = PageRenderer(directory="templates")  # вместо Jinja2Templates: байткод-кэш, кэш готового HTML и ETag
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pages.precompile("main.html", "users.html")     # шаблоны компилируются при старте, а не на первом запросе
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+install_metrics(app)  # GET /metrics: задержки, счетчики и размеры запросов по маршрутам
 
-templates = Jinja2Templates(directory="templates")
 
 # old get
 @app.get("/users", response_model=List[User])
-async def get_users_():
-    return users
+async def get_users_(
+        request: Request,
+        response: Response,
+        limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE, description="Размер страницы")] = None,
+        cursor: Annotated[Optional[int], Query(ge=0, description="id последнего пользователя предыдущей страницы")] = None,
+        fields: Annotated[Optional[str], Query(description="Поля через запятую, например id,username")] = None
+):
+    names = parse_fields(User, fields)
+    if names is None:
+        return await encoded_page_response(request, users, cursor, limit)
+    page, next_cursor = await resolve(users.page(cursor, limit))
+    return page_response(response, page, next_cursor, names, store=users)
 
 """
 Напишите новый запрос по маршруту '/':
@@ -36,15 +68,34 @@ async def get_users_():
 
 # new get
 @app.get("/", response_class=HTMLResponse)
-async def get_users(request: Request):
-    return templates.TemplateResponse("users.html", {"request": request, "users": users})
+async def get_users(
+        request: Request,
+        stream: Annotated[bool, Query(description="Отдавать страницу потоком, порциями (для больших списков)")] = False
+):
+    if stream:
+        return pages.stream(request, "users.html", "users", users.version, lambda: {"users": users.scan()})
+    # список рендерится в потоке по снимку хранилища (users.all()), event loop тем временем обслуживает запросы
+    return await pages.render_async(request, "users.html", "users", users.version, lambda: {"users": users.all()})
+
+
+# Лента изменений (Server-Sent Events) вместо опроса "/": события create/update/delete с номерами.
+# При переподключении EventSource сам присылает Last-Event-ID и получает пропущенные события;
+# событие reset означает, что список нужно перечитать целиком. Объявлен раньше /users/{user_id}.
+@app.get("/users/events")
+async def user_events(
+        since: Annotated[Optional[str], Query(
+            description="id последнего полученного события (\"<boot>-<seq>\") или номер <seq> текущего запуска"
+        )] = None,
+        last_event_id: Annotated[Optional[str], Header()] = None
+):
+    return event_stream_response(users.feed, last_event_id if last_event_id is not None else since)
 
 
 @app.get('/users/{user_id}', response_class=HTMLResponse)
 async def get_user_id(request: Request, user_id: int):
-    user = next((user for user in users if user.id == user_id), None)
+    user = users.get(user_id)
     if user:
-        return templates.TemplateResponse("users.html", {"request": request, "user": user})
+        return pages.render(request, "users.html", f"user-{user_id}", users.version, lambda: {"user": user})
     return {"error": "Пользователь не найден"}
 
 class UserCreate(BaseModel):
@@ -62,12 +113,11 @@ class UserCreate(BaseModel):
 
 @app.post("/users", response_model=User)
 async def create_user(user: UserCreate) -> User:  # переменная user, по которой FastAPI создает объект класса UserCreate
-    if any(u.username == user.username for u in users):  # или альтернативно: if user.username in [u.username for u in users]:
+    try:
+        new_user = await resolve(users.create(user.username, user.age))
+    except UsernameTaken:   # уникальность проверяет индекс хранилища (в SQLite - уникальный индекс базы)
         raise HTTPException(status_code=400, detail="Username already exists")
-    new_id = max((u.id for u in users), default=0) + 1
-    new_user = User(id=new_id, username=user.username, age=user.age)
-    users.append(new_user)
-    return new_user
+    return user_response(users, new_user)
 
 
 @app.post("/users/{username}/{age}", response_model=User)
@@ -89,13 +139,11 @@ async def create_user_(
             )
         ]
 ):
-    if any(u.username == username for u in
-           users):  # или альтернативно: if user.username in [u.username for u in users]:
+    try:
+        new_user = await resolve(users.create(username, age))
+    except UsernameTaken:
         raise HTTPException(status_code=400, detail="Username already exists")
-    new_id = max((u.id for u in users), default=0) + 1
-    new_user = User(id=new_id, username=username, age=age)
-    users.append(new_user)
-    return new_user
+    return user_response(users, new_user)
 
 
 @app.put('/users/{user_id}/{username}/{age}', response_model=User)
@@ -122,26 +170,36 @@ async def update_user(
             )
         ]
 ):
-    if users:
-        for user in users:
-            if user.id == user_id:  # в моей модели User пользователь называется id, а не user_id
-                user.username = username  # user[username] не правильно, так как не словарь, а объект и
-                # 'username' не правильно, тогда жестко задаю именно 'username', а надо передать параметр username
-                user.age = age
-                return user
-        else:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-    raise HTTPException(status_code=404, detail="Список пустой")
+    try:
+        user = await resolve(users.update(user_id, username, age))  # поиск по индексу id, а не перебором списка
+    except UsernameTaken:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    if user is None:
+        # пустое хранилище проверяем только при промахе, а не на каждом запросе
+        detail = "Пользователь не найден" if await resolve(users.count()) else "Список пустой"
+        raise HTTPException(status_code=404, detail=detail)
+    return user_response(users, user)
 
 
 @app.delete("/users/{user_id}", response_model=dict)
 async def delete_user(user_id: int):
-    for i, user in enumerate(users):
-        if user.id == user_id:
-            users.pop(i)  # или del users[i] - удаление по индексу
-            return {"detail": f"Пользователь {user_id} удален"}
+    if await resolve(users.delete(user_id)) is not None:  # удаление из dict за O(1), без сдвига как в list.pop(i)
+        return {"detail": f"Пользователь {user_id} удален"}
     raise HTTPException(status_code=404, detail="Пользователь не найден")
 
+# последней строкой после маршрутов: явные ошибки в параметрах пути отклоняются с 422 до pydantic
+install_fast_reject(app)
+# запись (POST/PUT/DELETE) под перегрузкой: лимит одновременных запросов на маршрут и бюджет ожидания, 503/429
+install_admission(app)
+# с журналом (USERS_DATA_DIR) запись отвечает после fsync своего изменения, одним fsync на одновременные запросы
+install_group_commit(app, storage, WRITE_METHODS)
+# ADMIN_TOKEN включает /admin/profile, /admin/memory и /admin/loop; без него этих маршрутов нет
+install_diagnostics(app, gauges=lambda: {
+    "users": len(users), "version": users.version, "live_snapshots": users.live_snapshots,
+    "cached_bodies": len(users.bodies), "cached_pages": pages.cached_pages,
+    "feed_subscribers": users.feed.subscriber_count if users.feed else 0,
+})
+
 
 """
 <!DOCTYPE html>     - тип документа, ! - не обычный тег, а декларация типа, <> обозначение тега
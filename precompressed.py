@@ -0,0 +1,153 @@
+"""
+Сжатые варианты готовых ответов (gzip, а при установленных пакетах - brotli и zstd) с выбором по Accept-Encoding.
+
+Сжимаются тела, которые уже кэшируются целиком: страница users.html (user_pages.py) и JSON GET /users
+хранилища с кэшем bodies (UserRepository, user_api.py) в любом режиме fast_json. Рядом с телом в записи кэша хранятся
+его сжатые варианты; каждый вариант строится при первом запросе с такой кодировкой. Запись кэша привязана
+к версии хранилища, поэтому после изменения данных страница сжимается заново один раз, а не на каждый запрос.
+
+- сжимаем только тела от MIN_SIZE байт: мелкий ответ после сжатия почти не уменьшается, а время тратится;
+- кодировку выбирает negotiate(): наибольший q из Accept-Encoding, при равных q - порядок CODECS
+  (br, zstd, gzip). q=0 запрещает кодировку, "*" относится ко всем не названным;
+- если сжатый вариант не меньше исходного, отдаем тело как есть;
+- ответ от MIN_SIZE байт получает Vary: Accept-Encoding, чтобы прокси не отдали сжатый вариант
+  клиенту, который его не поддерживает.
+"""
+
+import gzip
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, Optional
+
+from fastapi import Request, Response
+
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+ZSTD_LEVEL = 10
+
+
+def _codecs() -> Dict[str, Callable[[bytes], bytes]]:
+    # порядок - предпочтение сервера при равных q
+    codecs = {}
+    try:
+        import brotli
+        codecs["br"] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    except ImportError:
+        pass
+    try:
+        from compression import zstd       # Python 3.14+
+        codecs["zstd"] = lambda data: zstd.compress(data, level=ZSTD_LEVEL)
+    except ImportError:
+        try:
+            import zstandard
+            codecs["zstd"] = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+        except ImportError:
+            pass
+    codecs["gzip"] = lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0)
+    return codecs
+
+
+CODECS = _codecs()
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: str) -> Optional[str]:
+    # None - отдавать без сжатия. Различных значений заголовка у клиентов немного, поэтому разбор кэшируется
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        name, q = name.strip(), 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name] = q
+    best, best_q = None, 0.0
+    for name in CODECS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class Encoded:
+    """Готовое тело ответа и его сжатые варианты (строятся при первом запросе)."""
+    __slots__ = ("body", "_variants")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self._variants: Dict[str, Optional[bytes]] = {}
+
+    def variant(self, encoding: str) -> Optional[bytes]:
+        # None - сжатие не дало выигрыша, отдаем body
+        try:
+            return self._variants[encoding]
+        except KeyError:
+            data = CODECS[encoding](self.body)
+            data = self._variants[encoding] = data if len(data) < len(self.body) else None
+            return data
+
+
+class VariantCache:
+    """LRU: ключ -> (версия данных, значение с Encoded). Запись другой версии считается устаревшей."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: Hashable, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, version: int, value) -> None:
+        # версию вызывающий читает до того, как собрать данные: если они изменились во время построения,
+        # запись получит старую версию и не будет использована
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, version: int, build: Callable[[], bytes]) -> Encoded:
+        # build вызывается только при промахе
+        encoded = self.lookup(key, version)
+        if encoded is None:
+            encoded = Encoded(build())
+            self.put(key, version, encoded)
+        return encoded
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def encoded_response(request: Optional[Request], encoded: Encoded, media_type: str,
+                     headers: Optional[dict] = None, response_class=Response) -> Response:
+    headers = dict(headers) if headers else {}
+    if request is not None and len(encoded.body) >= MIN_SIZE:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding is not None:
+            data = encoded.variant(encoding)
+            if data is not None:
+                headers["Content-Encoding"] = encoding
+                return response_class(data, media_type=media_type, headers=headers)
+    return response_class(encoded.body, media_type=media_type, headers=headers)
+
+
+def compress_body(request: Optional[Request], body: bytes, media_type: str, headers: Optional[dict] = None) -> Response:
+    # для тел, которые не кэшируются: сжатие на каждый запрос, те же правила выбора
+    return encoded_response(request, Encoded(body), media_type, headers)
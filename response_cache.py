@@ -0,0 +1,100 @@
+"""
+Кэш готовых ответов для маршрутов чтения (pr_16_1_fast_api.py).
+
+Ответ кодируется в JSON один раз и хранится байтами; повторный запрос с теми же параметрами
+отдает эти байты без вызова кодировщика и без сборки f-строк.
+
+- ключ - кортеж (шаблон маршрута, параметры...), например ("/user/{user_id}", 3);
+- LRU: при превышении max_entries или max_bytes (сумма размеров тел) вытесняются давно не читанные записи;
+- TTL: запись старше ttl секунд считается устаревшей и строится заново;
+- invalidate(route, *params) / invalidate_route(route) / clear() - вызываются при изменении данных,
+  чтобы следующий запрос не получил старый ответ.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from fastapi import Response
+
+MAX_ENTRIES = 10_000
+MAX_BYTES = 16 * 1024 * 1024
+TTL_SECONDS = 60.0
+
+
+def encode_json(content) -> bytes:
+    # то же, что делает JSONResponse, поэтому тело ответа из кэша совпадает с обычным
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, ttl: Optional[float] = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl      # None - без срока, только LRU и явная инвалидация
+        self.size = 0       # байт в телах ответов
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, bytes]]" = OrderedDict()    # ключ -> (срок, тело)
+        self._lock = threading.Lock()       # синхронные маршруты (def) выполняются в пуле потоков
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        expires = float('inf') if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires, body)
+            self.size += len(body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def json(self, key: Tuple, build: Callable[[], object]) -> Response:
+        # build вызывается только при промахе: маршрут передает функцию, а не готовый словарь
+        body = self.get(key)
+        if body is None:
+            body = encode_json(build())
+            self.put(key, body)
+        return Response(body, media_type="application/json")
+
+    # --- инвалидация ---
+
+    def invalidate(self, route: str, *params: Hashable) -> None:
+        with self._lock:
+            if (route, *params) in self._entries:
+                self._drop((route, *params))
+
+    def invalidate_route(self, route: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == route]:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _drop(self, key: Tuple) -> None:
+        _, body = self._entries.pop(key)
+        self.size -= len(body)
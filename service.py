@@ -0,0 +1,138 @@
+"""
+Один процесс вместо пяти: приложения pr_16_1 ... pr_16_5 собраны в общее приложение FastAPI.
+
+    uvicorn service:app
+
+Маршруты каждого модуля переносятся в свой APIRouter с префиксом и подключаются через include_router:
+    /fast_api  - pr_16_1_fast_api.py      /pydantic - pr_16_4_pydantic.py
+    /path      - pr_16_2_path.py          /jinja    - pr_16_5_Jinja.py
+    /crud      - pr_16_3_CRUD.py
+Хранилища, шаблоны и обработчики остаются в модулях - сервис переносит только маршруты. Общие для
+сервиса: метрики (GET /metrics), быстрый отказ 422 для параметров пути (path_validators.py), /docs.
+Маршруты записи, ограниченные в модуле install_admission (admission.py), получают в сервисе те же
+ограничения с той же политикой, а модули с журналом (install_group_commit, user_storage.py) - такое же
+ожидание fsync перед ответом.
+
+При сборке маршруты проверяются на конфликты: два маршрута с одним методом и одинаковым шаблоном пути
+(имена параметров не важны) или маршрут без параметров, который перекрыт объявленным раньше маршрутом
+с параметрами. Вторая функция в таком случае никогда не вызывается - например, второй GET /user
+в pr_16_1_fast_api.py. Такие маршруты не подключаются и попадают в предупреждение в логе, а при
+SERVICE_STRICT_ROUTES=1 сборка завершается ошибкой RouteConflict.
+
+Тяжелые части создаются при первом использовании: jinja2 импортируется и шаблоны компилируются при
+первом запросе HTML-страницы (user_pages.py), соединения SQLite открываются при первом запросе к базе.
+lifespan модулей (precompile шаблонов в pr_16_5) в сервис не переносится.
+Время холодного старта и память процесса - benchmarks/bench_startup.py.
+"""
+
+import importlib
+import logging
+import os
+from typing import List, Tuple
+
+from fastapi import APIRouter, FastAPI
+from fastapi.routing import APIRoute
+
+from admission import WRITE_METHODS, admit_route
+from metrics import install_metrics
+from path_validators import install_fast_reject
+from user_storage import install_group_commit
+
+logger = logging.getLogger(__name__)
+
+MODULES = (
+    ("/fast_api", "pr_16_1_fast_api"),
+    ("/path", "pr_16_2_path"),
+    ("/crud", "pr_16_3_CRUD"),
+    ("/pydantic", "pr_16_4_pydantic"),
+    ("/jinja", "pr_16_5_Jinja"),
+)
+STRICT_ROUTES = os.getenv('SERVICE_STRICT_ROUTES', '') == '1'
+SERVICE_PATHS = ("/metrics",)   # у сервиса свои, одноименные маршруты модулей не переносятся
+
+
+class RouteConflict(RuntimeError):
+    pass
+
+
+def _shape(path: str) -> str:
+    # "/users/{user_id}" и "/users/{id}" совпадают для маршрутизатора
+    return "/".join("{}" if part.startswith("{") else part for part in path.split("/"))
+
+
+def route_conflicts(routes: List[APIRoute]) -> List[Tuple[APIRoute, APIRoute]]:
+    # (объявленный раньше, недостижимый) - Starlette выбирает первый подходящий маршрут
+    conflicts = []
+    for i, later in enumerate(routes):
+        for earlier in routes[:i]:
+            if not earlier.methods & later.methods:
+                continue
+            same = _shape(earlier.path) == _shape(later.path)
+            shadowed = "{" not in later.path and earlier.path_regex.match(later.path) is not None
+            if same or shadowed:
+                conflicts.append((earlier, later))
+                break
+    return conflicts
+
+
+def _describe(route: APIRoute) -> str:
+    return f"{','.join(sorted(route.methods))} {route.path} ({route.endpoint.__module__}.{route.name})"
+
+
+def module_router(prefix: str, module, route_class) -> Tuple[APIRouter, List[str]]:
+    # Переносит маршруты module.app в APIRouter с префиксом; возвращает роутер и список пропущенных конфликтов
+    source = [route for route in module.app.routes
+              if isinstance(route, APIRoute) and route.path not in SERVICE_PATHS]
+    skipped = {id(later): f"{_describe(later)} перекрыт {_describe(earlier)}"
+               for earlier, later in route_conflicts(source)}
+    router = APIRouter(prefix=prefix, tags=[prefix.strip("/")], route_class=route_class)
+    admitted = []   # (маршрут сервиса, политика допуска маршрута в модуле)
+    for route in source:
+        if id(route) in skipped:
+            continue
+        router.add_api_route(
+            route.path,
+            getattr(route, "unwrapped_endpoint", route.endpoint),
+            methods=sorted(route.methods),
+            response_model=route.response_model,
+            status_code=route.status_code,
+            response_class=route.response_class,
+            name=route.name,
+            summary=route.summary,
+            description=route.description,
+            dependencies=route.dependencies,
+            responses=route.responses,
+            deprecated=route.deprecated,
+            include_in_schema=route.include_in_schema,
+            response_model_exclude_none=route.response_model_exclude_none,
+        )
+        if getattr(route, "admission_policy", None) is not None:
+            admitted.append((router.routes[-1], route.admission_policy))
+    install_fast_reject(router)
+    # свои лимиты у сервиса, но только на маршрутах, ограниченных в модуле, и с их же политикой:
+    # маршруты без допуска в модуле (например, /admin диагностики) остаются без него и под перегрузкой
+    shared = {}
+    for route, policy in admitted:
+        admit_route(route, policy, shared)
+    # ожидание fsync журнала модуля - снаружи допуска, как и в самом модуле
+    storage = next((route.storage for route in source if getattr(route, "storage", None)), None)
+    install_group_commit(router, storage, WRITE_METHODS)
+    return router, list(skipped.values())
+
+
+def build_service(modules=MODULES, strict: bool = STRICT_ROUTES) -> FastAPI:
+    service = FastAPI(title="Users service")
+    install_metrics(service)
+    problems = []
+    for prefix, name in modules:
+        router, skipped = module_router(prefix, importlib.import_module(name), service.router.route_class)
+        problems += skipped
+        service.include_router(router)
+    if problems and strict:
+        raise RouteConflict("; ".join(problems))
+    for problem in problems:
+        logger.warning("маршрут не подключен: %s", problem)
+    return service
+
+
+app = build_service()
@@ -0,0 +1,327 @@
+"""
+Асинхронное хранилище пользователей на SQLite для pr_16_3_CRUD.py и pr_16_4_pydantic.py.
+
+Включается переменной окружения USERS_BACKEND=sqlite (файл базы - USERS_DATA_DIR/<имя>.sqlite3,
+по умолчанию в текущем каталоге). Методы повторяют UserRepository / UserRecords, но это корутины:
+маршруты вызывают их через resolve() из user_api.py и одинаково работают с обоими вариантами.
+
+- sqlite3 блокирующий, поэтому каждый запрос выполняется в потоке (asyncio.to_thread) и не держит event loop;
+- соединения берутся из ограниченного пула (SQLitePool): не больше pool_size одновременных обращений к базе;
+- журнал в режиме WAL: читатели не ждут писателя;
+- SQL-тексты постоянные, поэтому sqlite3 подготавливает каждый запрос один раз на соединение
+  (кэш cached_statements) и дальше только подставляет параметры;
+- уникальность username проверяет уникальный индекс базы, а не any(...) в Python.
+"""
+
+import asyncio
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional, Tuple
+
+from user_repository import (BatchRejected, UserRecord, UsernameTaken, check_cursor, model_builder, record_encoder,
+                             rows_encoder, search_order)
+
+BACKEND = os.getenv('USERS_BACKEND', 'memory')
+
+
+def sqlite_path(name: str) -> str:
+    directory = os.getenv('USERS_DATA_DIR', '.')
+    os.makedirs(directory, exist_ok=True)    # как и журнал WalStorage, каталог данных создается при старте
+    return os.path.join(directory, f'{name}.sqlite3')
+
+
+class SQLitePool:
+    def __init__(self, path: str, schema: str, size: int = 4, init: Optional[Callable] = None):
+        self.path = path
+        self.size = size
+        self._schema = schema
+        self._init = init
+        self._idle: Optional[asyncio.Queue] = None
+        self._created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')     # в режиме WAL fsync только на checkpoint
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.executescript(self._schema)
+        if self._init is not None:
+            self._init(conn)
+        return conn
+
+    async def run(self, work: Callable[[sqlite3.Connection], object]):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and self._created < self.size:
+            self._created += 1      # место занято сразу, чтобы одновременные запросы не открыли лишних соединений
+            try:
+                conn = await asyncio.to_thread(self._connect)
+            except BaseException:
+                self._created -= 1  # неудачное подключение не уменьшает пул навсегда
+                raise
+        else:
+            conn = await self._idle.get()       # пул исчерпан - ждем, пока освободится соединение
+        # shield: если запрос отменят, соединение вернется в пул только после того, как поток закончит с ним работу
+        return await asyncio.shield(self._use(conn, work))
+
+    async def _use(self, conn: sqlite3.Connection, work: Callable[[sqlite3.Connection], object]):
+        try:
+            return await asyncio.to_thread(work, conn)
+        finally:
+            self._idle.put_nowait(conn)
+
+
+def _transaction(conn: sqlite3.Connection, work: Callable[[], object]):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        result = work()
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return result
+
+
+USERS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    age INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username);
+CREATE INDEX IF NOT EXISTS users_age ON users (age);
+'''
+
+SELECT_USER = 'SELECT id, username, age FROM users WHERE id = ?'
+SELECT_PAGE = 'SELECT id, username, age FROM users WHERE id > ? ORDER BY id LIMIT ?'
+SELECT_COUNT = 'SELECT count(*) FROM users'
+SELECT_OWNER = 'SELECT id FROM users WHERE username = ?'
+INSERT_USER = 'INSERT INTO users (username, age) VALUES (?, ?)'
+UPDATE_USER = 'UPDATE users SET username = ?, age = ? WHERE id = ?'
+DELETE_USER = 'DELETE FROM users WHERE id = ?'
+# при обмене именами внутри пакета индекс не должен сработать на промежуточном состоянии
+RELEASE_USERNAME = "UPDATE users SET username = char(0) || id WHERE id = ?"
+
+
+class SQLiteUserRepository:
+    fast_json = False
+
+    def __init__(self, model, path: str, pool_size: int = 4):
+        self.model = model
+        self.to_model = model_builder(model)     # строки отдаются как UserRecord, модели строит user_api.py
+        self.encode_list = rows_encoder(model)
+        self.encode_record = record_encoder(model)
+        self.pool = SQLitePool(path, USERS_SCHEMA, pool_size)
+
+    def _user(self, row):
+        return None if row is None else UserRecord(row[0], row[1], row[2])
+
+    async def count(self) -> int:
+        return await self.pool.run(lambda conn: conn.execute(SELECT_COUNT).fetchone()[0])
+
+    async def get(self, user_id: int):
+        return self._user(await self.pool.run(lambda conn: conn.execute(SELECT_USER, (user_id,)).fetchone()))
+
+    async def page(self, cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List, Optional[int]]:
+        want = -1 if limit is None else limit + 1      # LIMIT -1 в SQLite - без ограничения
+        rows = await self.pool.run(lambda conn: conn.execute(SELECT_PAGE, (cursor or 0, want)).fetchall())
+        items = [self._user(row) for row in rows]
+        if limit is not None and len(items) > limit:
+            del items[limit:]
+            return items, items[-1].id
+        return items, None
+
+    async def search(self, age_min: Optional[int] = None, age_max: Optional[int] = None, prefix: Optional[str] = None,
+                     after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List, Optional[tuple]]:
+        # Порядок и курсор - как у UserRepository.search (search_order). Префикс - диапазон
+        # username >= prefix AND username < prefix + U+10FFFF: его, в отличие от LIKE, планировщик выполняет
+        # по индексу users_username; возраст - по индексу users_age, в котором строки уже упорядочены по (age, id)
+        order = search_order(age_min, age_max, prefix)
+        check_cursor(order, after)
+        if order == "id":
+            items, next_id = await self.page(None if after is None else after[0], limit)
+            return items, None if next_id is None else (next_id,)
+        where, params = [], []
+        if age_min is not None:
+            where.append('age >= ?')
+            params.append(age_min)
+        if age_max is not None:
+            where.append('age <= ?')
+            params.append(age_max)
+        if order == "username":
+            where.append('username >= ? AND username < ?')
+            params += [prefix, prefix + '\U0010ffff']
+            if after is not None:
+                where.append('username > ?')
+                params.append(after[0])
+            order_by, key = 'username', lambda user: (user.username,)
+        else:
+            if after is not None:
+                where.append('(age, id) > (?, ?)')
+                params += list(after)
+            order_by, key = 'age, id', lambda user: (user.age, user.id)
+        sql = f'SELECT id, username, age FROM users WHERE {" AND ".join(where)} ORDER BY {order_by} LIMIT ?'
+        params.append(-1 if limit is None else limit + 1)
+        rows = await self.pool.run(lambda conn: conn.execute(sql, params).fetchall())
+        items = [self._user(row) for row in rows]
+        if limit is not None and len(items) > limit:
+            del items[limit:]
+            return items, key(items[-1])
+        return items, None
+
+    async def create(self, username: str, age: int):
+        def work(conn):
+            try:
+                return conn.execute(INSERT_USER, (username, age)).lastrowid
+            except sqlite3.IntegrityError:
+                raise UsernameTaken(username)
+        user_id = await self.pool.run(work)
+        return UserRecord(user_id, username, age)
+
+    async def create_each(self, items: List[Tuple[str, int]]) -> List:
+        # Пакет независимых созданий (coalescer.py) - одна транзакция и один COMMIT на пакет.
+        # Неудачный INSERT откатывает только свою инструкцию: на месте элемента - UsernameTaken
+        def work(conn):
+            results = []
+            for username, age in items:
+                try:
+                    results.append(UserRecord(conn.execute(INSERT_USER, (username, age)).lastrowid, username, age))
+                except sqlite3.IntegrityError:
+                    results.append(UsernameTaken(username))
+            return results
+        return await self.pool.run(lambda conn: _transaction(conn, lambda: work(conn)))
+
+    async def update(self, user_id: int, username: str, age: int):
+        def work(conn):
+            try:
+                return conn.execute(UPDATE_USER, (username, age, user_id)).rowcount
+            except sqlite3.IntegrityError:
+                raise UsernameTaken(username)
+        if not await self.pool.run(work):
+            return None
+        return UserRecord(user_id, username, age)
+
+    async def delete(self, user_id: int):
+        def work(conn):
+            row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+            conn.execute(DELETE_USER, (user_id,))
+            return row
+        return self._user(await self.pool.run(lambda conn: _transaction(conn, lambda: work(conn))))
+
+    # Пакетные операции - одна транзакция на пакет; при любой ошибке откатывается весь пакет
+
+    async def create_many(self, items: List[Tuple[str, int]]) -> List:
+        def work(conn):
+            errors, seen = {}, set()
+            for i, (username, _) in enumerate(items):
+                if username in seen or conn.execute(SELECT_OWNER, (username,)).fetchone():
+                    errors[i] = "Username already exists"
+                seen.add(username)
+            if errors:
+                raise BatchRejected(errors)
+            return [conn.execute(INSERT_USER, item).lastrowid for item in items]
+        ids = await self.pool.run(lambda conn: _transaction(conn, lambda: work(conn)))
+        return [UserRecord(user_id, username, age) for user_id, (username, age) in zip(ids, items)]
+
+    async def update_many(self, items: List[Tuple[int, str, int]]) -> List:
+        batch_ids = {user_id for user_id, _, _ in items}
+
+        def work(conn):
+            errors, seen_ids, seen_names = {}, set(), set()
+            for i, (user_id, username, _) in enumerate(items):
+                owner = conn.execute(SELECT_OWNER, (username,)).fetchone()
+                if conn.execute(SELECT_USER, (user_id,)).fetchone() is None:
+                    errors[i] = "Пользователь не найден"
+                elif user_id in seen_ids:
+                    errors[i] = "Duplicate user id in batch"
+                elif username in seen_names or (owner is not None and owner[0] != user_id and owner[0] not in batch_ids):
+                    errors[i] = "Username already exists"
+                seen_ids.add(user_id)
+                seen_names.add(username)
+            if errors:
+                raise BatchRejected(errors)
+            conn.executemany(RELEASE_USERNAME, [(user_id,) for user_id in batch_ids])
+            conn.executemany(UPDATE_USER, [(username, age, user_id) for user_id, username, age in items])
+        await self.pool.run(lambda conn: _transaction(conn, lambda: work(conn)))
+        return [UserRecord(user_id, username, age) for user_id, username, age in items]
+
+    async def delete_many(self, user_ids: List[int]) -> List:
+        def work(conn):
+            errors, seen, rows = {}, set(), []
+            for i, user_id in enumerate(user_ids):
+                row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+                if user_id in seen:
+                    errors[i] = "Duplicate user id in batch"
+                elif row is None:
+                    errors[i] = "Пользователь не найден"
+                seen.add(user_id)
+                rows.append(row)
+            if errors:
+                raise BatchRejected(errors)
+            conn.executemany(DELETE_USER, [(user_id,) for user_id in user_ids])
+            return rows
+        rows = await self.pool.run(lambda conn: _transaction(conn, lambda: work(conn)))
+        return [self._user(row) for row in rows]
+
+
+RECORDS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+'''
+
+
+class SQLiteRecords:
+    """Аналог UserRecords (строковые записи pr_16_3_CRUD.py) поверх SQLite."""
+
+    def __init__(self, path: str, initial: Optional[Dict[str, str]] = None, pool_size: int = 4):
+        self._seed = [(int(key), value) for key, value in (initial or {}).items()]
+        self.pool = SQLitePool(path, RECORDS_SCHEMA, pool_size, init=self._seed_once)
+
+    def _seed_once(self, conn: sqlite3.Connection) -> None:
+        # начальный словарь записываем только в новую таблицу: sqlite_sequence помнит, что вставки уже были,
+        # даже если потом все записи удалили
+        def work():
+            if not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'records'").fetchone():
+                conn.executemany('INSERT INTO records (id, record) VALUES (?, ?)', self._seed)
+        if self._seed:
+            _transaction(conn, work)
+
+    async def _run(self, work):
+        return await self.pool.run(work)
+
+    async def as_dict(self) -> Dict[str, str]:
+        rows = await self._run(lambda conn: conn.execute('SELECT id, record FROM records ORDER BY id').fetchall())
+        return {str(user_id): record for user_id, record in rows}
+
+    async def page(self, cursor: Optional[int] = None, limit: Optional[int] = None):
+        want = -1 if limit is None else limit + 1
+        rows = await self._run(lambda conn: conn.execute(
+            'SELECT id, record FROM records WHERE id > ? ORDER BY id LIMIT ?', (cursor or 0, want)).fetchall())
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            del rows[limit:]
+            next_cursor = rows[-1][0]
+        return {str(user_id): record for user_id, record in rows}, next_cursor
+
+    async def add(self, record: str) -> str:
+        return str(await self._run(lambda conn: conn.execute(
+            'INSERT INTO records (record) VALUES (?)', (record,)).lastrowid))
+
+    async def set(self, user_id: str, record: str) -> bool:
+        if not user_id.isdigit():
+            return False
+        return bool(await self._run(lambda conn: conn.execute(
+            'UPDATE records SET record = ? WHERE id = ?', (record, int(user_id))).rowcount))
+
+    async def delete(self, user_id: str) -> Optional[str]:
+        if not user_id.isdigit():
+            return None
+
+        def work(conn):
+            row = conn.execute('SELECT record FROM records WHERE id = ?', (int(user_id),)).fetchone()
+            conn.execute('DELETE FROM records WHERE id = ?', (int(user_id),))
+            return row
+        row = await self._run(lambda conn: _transaction(conn, lambda: work(conn)))
+        return None if row is None else row[0]
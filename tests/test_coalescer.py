@@ -0,0 +1,48 @@
+"""
+WriteCoalescer: асинхронные пакеты применяются по одному и по порядку, даже когда очередь набирает
+max_batch элементов, пока пакет еще выполняется.
+"""
+
+import asyncio
+
+from coalescer import WriteCoalescer
+
+
+def test_full_batches_wait_for_the_batch_in_flight():
+    running, applied, overlaps = [], [], []
+
+    async def apply(items):
+        if running:
+            overlaps.append(items)
+        running.append(items)
+        await asyncio.sleep(0.01)
+        running.remove(items)
+        applied.extend(items)
+        return [item * 10 for item in items]
+
+    async def main():
+        coalescer = WriteCoalescer(apply, max_batch=4)
+        first = [asyncio.ensure_future(coalescer.submit(i)) for i in range(2)]
+        await asyncio.sleep(0.001)      # первый пакет уже выполняется
+        rest = [asyncio.ensure_future(coalescer.submit(i)) for i in range(2, 20)]
+        return await asyncio.gather(*first, *rest), coalescer
+
+    results, coalescer = asyncio.run(main())
+    assert results == [i * 10 for i in range(20)]
+    assert applied == list(range(20)) and not overlaps
+    assert coalescer.batches == 1 + 18 // 4 + 1 and coalescer._in_flight is None
+
+
+def test_sync_apply_splits_a_long_queue_into_max_batch_chunks():
+    sizes = []
+
+    def apply(items):
+        sizes.append(len(items))
+        return items
+
+    async def main():
+        coalescer = WriteCoalescer(apply, max_batch=3)
+        return await asyncio.gather(*(coalescer.submit(i) for i in range(7)))
+
+    assert asyncio.run(main()) == list(range(7))
+    assert sizes == [3, 3, 1]
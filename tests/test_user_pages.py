@@ -0,0 +1,22 @@
+"""
+Условные запросы страниц (PageRenderer): If-None-Match сравнивается с ETag целиком и слабо.
+"""
+
+import pytest
+
+from user_pages import etag_matches
+
+ETAG = 'W/"ab12-users-3"'
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    (ETAG, True),
+    ('"ab12-users-3"', True),                   # слабое сравнение: W/ не учитывается
+    ('W/"other", W/"ab12-users-3"', True),
+    ("*", True),
+    ('W/"ab12-users-33"', False),
+    ('xx W/"ab12-users-3" yy', False),          # подстрока - не совпадение
+])
+def test_if_none_match(header, expected):
+    assert etag_matches(header, ETAG) is expected
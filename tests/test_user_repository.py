@@ -0,0 +1,72 @@
+"""
+Снимки UserRepository: после изменения собираются заново только измененные куски, а прошлые снимки
+не меняются.
+"""
+
+from pydantic import BaseModel
+
+import user_repository
+from user_repository import UserRepository
+
+
+class User(BaseModel):
+    id: int
+    username: str
+    age: int
+
+
+def test_snapshot_rebuilds_only_changed_chunks(monkeypatch):
+    monkeypatch.setattr(user_repository, "SNAPSHOT_CHUNK", 4)
+    users = UserRepository(User)
+    users.create_many([(f"user{i}", 20 + i) for i in range(20)])
+    before = users.snapshot()
+    assert [user.id for user in before] == list(range(1, 21))
+
+    users.update(6, "renamed", 30)
+    users.delete(9)
+    users.create("last", 40)
+    after = users.snapshot()
+
+    assert list(after) == list(users._by_id.values()) and len(after) == 20
+    assert [user.username for user in before][5] == "user5"     # прошлый снимок не изменился
+    changed = {id(chunk) for chunk in after.chunks} - {id(chunk) for chunk in before.chunks}
+    assert len(changed) == 3    # куски id 6, id 9 и последний, остальные общие с прошлым снимком
+    assert users.snapshot() is after
+
+
+def test_snapshot_drops_emptied_chunks(monkeypatch):
+    monkeypatch.setattr(user_repository, "SNAPSHOT_CHUNK", 4)
+    users = UserRepository(User)
+    users.create_many([(f"user{i}", 20) for i in range(10)])
+    users.snapshot()
+    for user_id in (4, 5, 6, 7):
+        users.delete(user_id)
+    snapshot = users.snapshot()
+    assert [user.id for user in snapshot] == [1, 2, 3, 8, 9, 10]
+    assert all(snapshot.chunks)
+
+
+def test_sorted_index_skips_removed_keys_and_compacts():
+    index = user_repository.SortedIndex()
+    for key in range(10):
+        index.add(key)
+    index.remove(3)
+    index.remove(4)
+    assert list(index.walk(0, 10)) == [0, 1, 2, 5, 6, 7, 8, 9] and len(index) == 8
+    index.add(3)        # ключ вернулся до сборки списка
+    assert list(index.walk(2, 6)) == [2, 3, 5]
+    for key in (0, 1, 2, 5, 6, 7):
+        index.remove(key)
+    assert list(index.walk(0, 10)) == [3, 8, 9] and len(index) == 3
+    assert len(index._keys) < 10 and len(index._dead) * 2 <= len(index._keys)  # список пересобран
+    assert list(index.walk(0, 10, after=3)) == [8, 9]
+
+
+def test_rename_and_delete_keep_search_consistent():
+    users = UserRepository(User)
+    users.create_many([(f"user{i}", 20 + i % 3) for i in range(10)])
+    users.update(1, "other", 22)
+    users.delete(2)
+    users.create("user1", 20)       # имя удаленного пользователя занято снова
+    assert [user.username for user in users.search(prefix="user")[0]] == [f"user{i}" for i in range(10) if i != 0]
+    assert [user.id for user in users.search(age_min=22, age_max=22)[0]] == [1, 3, 6, 9]
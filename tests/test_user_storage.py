@@ -0,0 +1,170 @@
+"""
+Журнал user_storage.WalStorage: восстановление, недописанная строка после сбоя, снимок и его повтор
+при старте, подтверждение записи после fsync.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from user_repository import UserRecords, UserRepository
+from user_storage import WalStorage
+
+
+class User(BaseModel):
+    id: int
+    username: str
+    age: int
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "data")
+
+
+def reopen(directory, **kwargs):
+    storage = WalStorage(directory, **kwargs)
+    return storage, storage.recover()
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "не дождались фонового потока журнала"
+        time.sleep(0.01)
+
+
+def test_recover_replays_puts_and_deletes(directory):
+    storage, (next_id, records) = reopen(directory)
+    assert (next_id, records) == (1, {})
+    storage.put(1, {"username": "alice", "age": 30})
+    storage.put(2, {"username": "bob", "age": 40})
+    storage.put(1, {"username": "alice2", "age": 31})
+    storage.delete(2)
+    storage.close()
+
+    storage, (next_id, records) = reopen(directory)
+    storage.close()
+    assert records == {1: {"username": "alice2", "age": 31}}
+    assert next_id == 3     # id удаленного пользователя не выдается повторно
+
+
+def test_torn_last_line_is_cut_and_new_writes_survive(directory):
+    storage, _ = reopen(directory)
+    storage.put(1, {"username": "alice", "age": 30})
+    storage.close()
+    with open(os.path.join(directory, "users.wal"), "ab") as f:
+        f.write(b'[2,"put",2,{"username":"bo')     # сбой посреди записи строки
+
+    storage, (next_id, records) = reopen(directory)
+    assert records == {1: {"username": "alice", "age": 30}} and next_id == 2
+    storage.put(2, {"username": "carol", "age": 25})
+    storage.close()
+
+    storage, (_, records) = reopen(directory)
+    storage.close()
+    assert records == {1: {"username": "alice", "age": 30}, 2: {"username": "carol", "age": 25}}
+
+
+def test_snapshot_is_written_in_background_and_replayed_with_wal_tail(directory):
+    storage = WalStorage(directory, snapshot_every=10)
+    users = UserRepository(User, storage=storage)
+    users.create_many([(f"user{i}", 20 + i) for i in range(12)])     # снимок по 12 записям
+    snapshot_path = os.path.join(directory, "users.snapshot")
+    wait_for(lambda: storage._snapshotter is None)
+    users.update(1, "renamed", 99)
+    users.delete(2)
+    storage.close()
+
+    with open(snapshot_path, "rb") as f:
+        header = json.loads(f.readline())
+        assert header == {"next_id": 13, "seq": 12} and len(f.readlines()) == 12
+    with open(os.path.join(directory, "users.wal"), "rb") as f:
+        assert [json.loads(line)[0] for line in f] == [13, 14]     # в журнале только записи новее снимка
+
+    users = UserRepository(User, storage=WalStorage(directory))
+    users._storage.close()
+    assert len(users) == 11
+    assert (users.get(1).username, users.get(1).age) == ("renamed", 99)
+    assert users.get(2) is None
+    assert users.create("next", 1).id == 13
+
+
+def test_records_snapshot_keeps_writes_made_while_it_is_written(directory):
+    storage = WalStorage(directory, snapshot_every=5)
+    records = UserRecords({"1": "first"}, storage=storage)
+    for i in range(10):
+        records.add(f"record {i}")
+    wait_for(lambda: storage._snapshotter is None)
+    storage.close()
+
+    records = UserRecords({"1": "first"}, storage=WalStorage(directory))
+    records._storage.close()
+    assert len(records) == 11 and records.get("11") == "record 9"
+
+
+def test_durable_write_is_acknowledged_after_fsync(directory):
+    storage, _ = reopen(directory, commit_interval=60)     # без ожидающих фоновый поток спал бы минуту
+
+    async def write():
+        storage.put(1, {"username": "alice", "age": 30})
+        waiter = storage.synced(storage.last_seq)
+        assert waiter is not None and storage._durable_seq == 0
+        await asyncio.wait_for(waiter, 5)
+        return storage._durable_seq
+
+    assert asyncio.run(write()) == 1
+    with open(os.path.join(directory, "users.wal"), "rb") as f:
+        assert json.loads(f.readline())[:3] == [1, "put", 1]
+    storage.close()
+
+
+def test_async_mode_acknowledges_before_fsync(directory):
+    storage, _ = reopen(directory, commit_interval=60, durable=False)
+
+    async def write():
+        storage.put(1, {"username": "alice", "age": 30})
+        return storage.synced(storage.last_seq)
+
+    assert asyncio.run(write()) is None
+    storage.close()
+
+
+def test_tail_offset_finds_first_entry_after_seq(tmp_path):
+    lines = [json.dumps([seq, "put", seq, {"n": "x" * (seq % 7)}]).encode() + b"\n" for seq in range(1, 101)]
+    path = tmp_path / "users.wal"
+    path.write_bytes(b"".join(lines))
+    with open(path, "rb") as f:
+        for seq in (0, 1, 37, 99, 100, 150):
+            assert f.seek(WalStorage._tail_offset(f, seq)) == sum(map(len, lines[:min(seq, 100)]))
+    path.write_bytes(b"")
+    with open(path, "rb") as f:
+        assert WalStorage._tail_offset(f, 5) == 0
+
+
+def test_close_stops_a_running_snapshot_and_removes_its_temporary_file(directory):
+    storage, _ = reopen(directory)
+    storage.put(1, {"username": "alice", "age": 30})
+    started = threading.Event()
+
+    def slow_items():
+        for key in range(1000):
+            started.set()
+            time.sleep(0.01)
+            yield key, {"username": f"user{key}", "age": 30}
+
+    storage.schedule_snapshot(1001, slow_items)
+    assert started.wait(5)
+    storage.close()
+    assert storage._snapshotter is None
+    assert not os.path.exists(storage.snapshot_path + ".tmp")
+    assert not os.path.exists(storage.snapshot_path)
+
+    storage, (next_id, records) = reopen(directory)
+    assert records == {1: {"username": "alice", "age": 30}}
+    storage.close()
@@ -0,0 +1,158 @@
+"""
+Общие помощники для маршрутов GET /users в pr_16_3_CRUD.py, pr_16_4_pydantic.py и pr_16_5_Jinja.py.
+
+Пагинация - keyset по индексу id: клиент передает limit и cursor (id последнего полученного пользователя),
+а курсор следующей страницы возвращается в заголовке X-Next-Cursor. У GET /users/search курсор - ключ
+последней записи в индексе поиска (encode_cursor), непрозрачная строка: клиент передает ее обратно как есть.
+Без limit маршрут, как и раньше, отдает всю коллекцию. Параметр fields=id,username оставляет в ответе только перечисленные поля.
+
+Хранилища отдают компактные записи UserRecord. Списки кодируются из них сразу в JSON (store.encode_list,
+без модели на строку), а модель User строится (store.to_model) только для ответа с одним пользователем.
+
+Готовая страница GET /users берется из кэша bodies хранилища (если он у хранилища есть, как у UserRepository)
+вместе с уже сжатыми по Accept-Encoding вариантами (encoded_page_response, precompressed.py); остальные списки
+кодируются и сжимаются на месте. Режим fast_json (USERS_FAST_JSON=1) включается на хранилище и меняет то,
+как байты получаются: каждая запись кэширует свой JSON, список склеивается из него, а ответ с одним
+пользователем отдается этими байтами без проверки response_model. Без fast_json список кодируется целиком
+за один вызов (encode_rows), а такой кэш не наполняется.
+Всю коллекцию от OFFLOAD_ITEMS пользователей encoded_page_response кодирует в потоке: записи хранилища
+неизменяемы, поэтому сериализация не видит полупримененных изменений и не держит event loop.
+
+Выгрузка GET /users/export идет потоком (NDJSON или CSV) порциями по EXPORT_BATCH_SIZE строк.
+"""
+
+import asyncio
+import base64
+import binascii
+import csv
+import inspect
+import io
+import json
+import os
+from typing import AsyncIterator, List, Optional, Union
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from precompressed import compress_body, encoded_response
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+MAX_PAGE_SIZE = 1000
+FAST_JSON = os.getenv('USERS_FAST_JSON', '') == '1'
+EXPORT_BATCH_SIZE = 1000
+OFFLOAD_ITEMS = 10_000
+
+
+async def resolve(result):
+    # Хранилища в памяти отвечают сразу, SQLite-хранилище возвращает корутину - маршрутам все равно
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def parse_fields(model, fields: Optional[str]) -> Optional[List[str]]:
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if not names:
+        raise HTTPException(status_code=422, detail="Не указаны поля для fields")
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    return names
+
+
+def encode_cursor(key: Optional[tuple]) -> Optional[str]:
+    # base64url от JSON ключа: в ключе может быть username, а заголовок ответа - только latin-1
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        key = None
+    if not isinstance(key, list):
+        raise HTTPException(status_code=422, detail="Некорректный cursor")
+    return tuple(key)
+
+
+def json_response(body: bytes, headers: Optional[dict] = None) -> Response:
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def user_response(store, user):
+    if store.fast_json:
+        return json_response(store.encode(user))
+    return store.to_model(user)
+
+
+def _page_headers(next_cursor: Optional[Union[int, str]]) -> dict:
+    return {} if next_cursor is None else {NEXT_CURSOR_HEADER: str(next_cursor)}
+
+
+def page_response(response: Response, items, next_cursor: Optional[Union[int, str]], fields: Optional[List[str]] = None,
+                  store=None, request: Optional[Request] = None):
+    headers = _page_headers(next_cursor)
+    if fields is None and store is not None:
+        # записи хранилища кодируются списком сразу в байты, без модели User на каждую строку
+        return compress_body(request, store.encode_list(items), 'application/json', headers)
+    if fields is None:
+        response.headers.update(headers)
+        return items
+    # проекция не совпадает с response_model, поэтому кодируем только нужные поля сразу в JSONResponse
+    return JSONResponse([{name: getattr(item, name) for name in fields} for item in items], headers=headers)
+
+
+async def encoded_page_response(request: Request, store, cursor: Optional[int], limit: Optional[int]) -> Response:
+    # GET /users хранилища в памяти: тело и его сжатые варианты из кэша хранилища (до следующего изменения)
+    page = store.bodies.lookup((cursor, limit), store.version)
+    if page is None and limit is None and len(store) >= OFFLOAD_ITEMS:
+        page = await asyncio.to_thread(store.encode_page, cursor, limit)
+    elif page is None:
+        page = store.encode_page(cursor, limit)
+    encoded, next_cursor = page
+    return encoded_response(request, encoded, 'application/json', _page_headers(next_cursor))
+
+
+async def _export_ndjson(store, batch: int) -> AsyncIterator[bytes]:
+    # без fast_json не наполняем кэш байтов хранилища: выгрузка миллионов строк должна идти в постоянной памяти
+    encode = store.encode if store.fast_json else store.encode_record
+    cursor = None
+    while True:
+        items, cursor = await resolve(store.page(cursor, batch))
+        if items:
+            yield b'\n'.join([encode(user) for user in items]) + b'\n'
+        if cursor is None:
+            return
+        await asyncio.sleep(0)  # отдаем event loop другим запросам между порциями
+
+
+async def _export_csv(store, batch: int) -> AsyncIterator[bytes]:
+    names = list(store.model.model_fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    cursor = None
+    while True:
+        items, cursor = await resolve(store.page(cursor, batch))
+        writer.writerows([[getattr(user, name) for name in names] for user in items])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        if cursor is None:
+            return
+        await asyncio.sleep(0)
+
+
+def export_response(store, fmt: str, batch: int = EXPORT_BATCH_SIZE) -> StreamingResponse:
+    # StreamingResponse ждет отправки каждой порции (await send), поэтому медленный клиент притормаживает
+    # генератор, а не копит выгрузку в памяти сервера
+    if fmt == 'csv':
+        return StreamingResponse(_export_csv(store, batch), media_type='text/csv',
+                                 headers={'Content-Disposition': 'attachment; filename="users.csv"'})
+    return StreamingResponse(_export_ndjson(store, batch), media_type='application/x-ndjson')
@@ -0,0 +1,128 @@
+"""
+Рендеринг HTML-страниц pr_16_5_Jinja.py (users.html / main.html) с кэшем.
+
+- Шаблоны компилируются один раз при старте приложения (precompile), а скомпилированный байткод
+  сохраняется на диск (FileSystemBytecodeCache), чтобы следующий запуск не разбирал шаблоны заново.
+- jinja2 импортируется и Environment создается при первом обращении (env), а не при импорте модуля:
+  в общем сервисе (service.py) процесс, который не отдает HTML, не тратит на это время и память.
+- Готовый HTML хранится по ключу страницы и номеру версии хранилища: пока пользователи не менялись,
+  страница не рендерится повторно. Рядом с HTML в кэше лежат его сжатые варианты (precompressed.py):
+  страница сжимается один раз на версию, кодировка выбирается по Accept-Encoding.
+- Каждая страница получает ETag. Если браузер прислал If-None-Match с той же версией, отвечаем 304 без тела.
+- Для очень больших списков есть потоковый режим (stream): шапка main.html уходит клиенту сразу,
+  а элементы списка - порциями по STREAM_CHUNK_SIZE байт, без сборки всей страницы в одну строку.
+  Потоковые ответы не кэшируются и не сжимаются.
+- render_async рендерит шаблон в потоке (asyncio.to_thread): данные для шаблона (снимок хранилища)
+  собираются в event loop и дальше не меняются, а большой список не держит event loop на время рендера.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
+from metrics import timed
+from precompressed import Encoded, VariantCache, encoded_response
+
+MAX_CACHED_PAGES = 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match: список ETag через запятую или "*". Сравнение слабое (RFC 9110): префикс W/ не учитывается,
+    # значения сравниваются целиком, а не поиском подстроки
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+class PageRenderer:
+    def __init__(self, directory: str = "templates", bytecode_dir: Optional[str] = None):
+        self.directory = directory
+        self.bytecode_dir = bytecode_dir    # None - временный каталог системы
+        self._env = None
+        self._pages = VariantCache(MAX_CACHED_PAGES)     # ключ -> (версия, html и его сжатые варианты)
+        self._boot = os.urandom(4).hex()    # чтобы ETag прошлого запуска не совпал с версией нового
+
+    @property
+    def env(self):
+        if self._env is None:
+            from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+            self._env = Environment(
+                loader=FileSystemLoader(self.directory),
+                autoescape=select_autoescape(),
+                bytecode_cache=FileSystemBytecodeCache(self.bytecode_dir),
+                auto_reload=False,      # шаблоны не меняются на ходу, не проверяем mtime при каждом запросе
+            )
+        return self._env
+
+    @property
+    def cached_pages(self) -> int:
+        return len(self._pages)
+
+    def precompile(self, *names: str) -> None:
+        for name in names:
+            self.env.get_template(name)
+
+    def etag(self, key: str, version: int) -> str:
+        return f'W/"{self._boot}-{key}-{version}"'
+
+    def _not_modified(self, request: Request, key: str, version: int):
+        etag = self.etag(key, version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers), headers
+        return None, headers
+
+    def render(self, request: Request, name: str, key: str, version: int, context: Callable[[], dict]) -> Response:
+        # context - функция, а не словарь: при попадании в кэш не нужно даже собирать данные для шаблона
+        not_modified, headers = self._not_modified(request, key, version)
+        if not_modified is not None:
+            return not_modified
+        page = self._pages.get(key, version, lambda: self._render(name, context()))
+        return encoded_response(request, page, "text/html", headers, HTMLResponse)
+
+    async def render_async(self, request: Request, name: str, key: str, version: int,
+                           context: Callable[[], dict]) -> Response:
+        not_modified, headers = self._not_modified(request, key, version)
+        if not_modified is not None:
+            return not_modified
+        page = self._pages.lookup(key, version)
+        if page is None:
+            page = Encoded(await asyncio.to_thread(self._render, name, context()))
+            self._pages.put(key, version, page)
+        return encoded_response(request, page, "text/html", headers, HTMLResponse)
+
+    def _render(self, name: str, context: dict) -> bytes:
+        with timed("render"):
+            return self.env.get_template(name).render(**context).encode()
+
+    def stream(self, request: Request, name: str, key: str, version: int, context: Callable[[], dict],
+               chunk_size: int = STREAM_CHUNK_SIZE) -> Response:
+        not_modified, headers = self._not_modified(request, key, version)
+        if not_modified is not None:
+            return not_modified
+        return StreamingResponse(self._chunks(name, context(), chunk_size), media_type="text/html", headers=headers)
+
+    async def _chunks(self, name: str, context: dict, chunk_size: int) -> AsyncIterator[bytes]:
+        # generate() отдает шаблон кусками по мере рендеринга. Первый кусок (шапка main.html до блока container)
+        # отправляем сразу, остальные копим до chunk_size. Между порциями отдаем управление event loop,
+        # чтобы рендер огромного списка не задерживал другие запросы.
+        parts = self.env.get_template(name).generate(**context)
+        yield next(parts, "").encode()
+        buffer, size = [], 0
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield "".join(buffer).encode()
+                buffer, size = [], 0
+                await asyncio.sleep(0)
+        if buffer:
+            yield "".join(buffer).encode()
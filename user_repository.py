@@ -0,0 +1,714 @@
+"""
+Хранилище пользователей для pr_16_4_pydantic.py и pr_16_5_Jinja.py.
+
+Вместо списка users: List[User], который приходится перебирать целиком при каждой операции, держим:
+    - хэш-индекс id -> UserRecord (поиск, обновление и удаление за O(1)). UserRecord - компактная запись
+      на __slots__: данные уже проверены на входе, поэтому хранилище не держит по экземпляру BaseModel
+      на пользователя. Методы чтения отдают UserRecord, а модели User строятся только при формировании
+      ответа (user_api.py) через to_model();
+    - уникальный индекс username -> id (проверка "Username already exists" за O(1), без any(...));
+    - монотонный счетчик id (не нужно считать max(u.id for u in users) + 1);
+    - отсортированный индекс id для keyset-пагинации (limit/cursor) в GET /users;
+    - вторичные отсортированные индексы (age, id) и username для GET /users/search: начало диапазона
+      возрастов или префикса имени находится через bisect за O(log n), дальше индекс обходится по порядку
+      ключей до limit подходящих записей (keyset-курсор - ключ последней записи), без перебора всех пользователей;
+    - записи не меняются после создания: update кладет вместо записи новую (копирование при записи).
+      Поэтому прочитанная запись всегда согласована, а snapshot() отдает неизменяемый снимок всего
+      хранилища - его можно сериализовать или рендерить в другом потоке, пока писатели продолжают работу.
+      Снимок состоит из кусков по SNAPSHOT_CHUNK id: после изменения заново собираются только измененные
+      куски, остальные общие с прошлым снимком;
+    - кэш JSON-байтов каждого пользователя для режима fast_json (хранится в самой записи, новая запись
+      после update приходит без него) и кэш bodies готовых страниц GET /users вместе с их сжатыми
+      вариантами (precompressed.py), он сбрасывается при любом изменении;
+    - номер версии, который растет при каждом create/update/delete (по нему кэшируются HTML-страницы);
+    - необязательная лента изменений (feed, см. change_feed.py): каждое create/update/delete публикуется
+      событием для подписчиков GET /users/events;
+    - необязательное постоянное хранение (storage, см. user_storage.py): состояние восстанавливается при
+      создании хранилища, а каждое изменение дописывается в журнал.
+
+Изменения выполняются под threading.Lock: проверка уникальности, выдача id и вставка атомарны, даже если
+маршруты работают в пуле потоков. Хранилище живет в памяти одного процесса - при запуске нескольких
+воркеров (uvicorn --workers N) у каждого своя копия; общий для всех процессов вариант - USERS_BACKEND=sqlite.
+"""
+
+import threading
+import weakref
+from bisect import bisect_left, bisect_right, insort
+from functools import wraps
+from itertools import chain, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
+
+from precompressed import Encoded, VariantCache
+
+MAX_CACHED_BODIES = 256
+SNAPSHOT_CHUNK = 1024       # id в одном куске снимка
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class IdIndex:
+    """
+    Отсортированный список id для keyset-пагинации: поиск курсора через bisect за O(log n).
+
+    id выдаются по возрастанию, поэтому вставка - это append. Удаленные id не вырезаются из списка сразу
+    (это был бы сдвиг элементов, как в list.pop(i)), а пропускаются при чтении; когда удаленных
+    становится больше половины, список пересобирается.
+    """
+
+    def __init__(self, is_live: Callable[[int], bool]):
+        self._ids: List[int] = []
+        self._dead = 0
+        self._is_live = is_live
+
+    def append(self, item_id: int) -> None:
+        self._ids.append(item_id)
+
+    def discard(self) -> None:
+        self._dead += 1
+        if self._dead * 2 > len(self._ids):
+            self._ids = [item_id for item_id in self._ids if self._is_live(item_id)]
+            self._dead = 0
+
+    def page(self, cursor: Optional[int], limit: Optional[int]) -> Tuple[List[int], Optional[int]]:
+        # Возвращает id страницы и курсор следующей страницы (None, если это последняя).
+        # Берем срезами: удаленных не больше половины, поэтому обычно хватает одного среза длиной 2 * limit.
+        start = 0 if cursor is None else bisect_right(self._ids, cursor)
+        want = None if limit is None else limit + 1     # +1, чтобы узнать, есть ли следующая страница
+        ids: List[int] = []
+        while start < len(self._ids) and (want is None or len(ids) < want):
+            stop = len(self._ids) if want is None else start + 2 * (want - len(ids))
+            chunk = self._ids[start:stop]
+            ids.extend([item_id for item_id in chunk if self._is_live(item_id)] if self._dead else chunk)
+            start = stop
+        if want is not None and len(ids) >= want:
+            del ids[limit:]
+            return ids, ids[-1]
+        return ids, None
+
+
+class SortedIndex:
+    """
+    Отсортированный список ключей для запросов по диапазону: границы ищутся через bisect за O(log n),
+    ответ - срез между ними.
+
+    Новые ключи сначала копятся в _pending и вливаются перед следующим чтением: по одному через insort,
+    если их немного, или одной сортировкой, если это пакет (create_many, восстановление с диска) - иначе
+    загрузка миллиона пользователей стоила бы миллион сдвигов списка. Удаленные ключи, как и в IdIndex,
+    не вырезаются из списка (del со сдвигом), а попадают в _dead и пропускаются при чтении; когда их
+    становится больше половины, список пересобирается. Поэтому удаление и смена ключа (update) - O(1).
+    """
+
+    BULK = 64
+
+    def __init__(self):
+        self._keys: list = []
+        self._pending: list = []
+        self._dead: set = set()
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._pending) - len(self._dead)
+
+    def add(self, key) -> None:
+        if key in self._dead:
+            self._dead.discard(key)     # ключ вернулся (например, имя освободили и заняли снова): он уже на месте
+        else:
+            self._pending.append(key)
+
+    def remove(self, key) -> None:
+        self._dead.add(key)
+        if len(self._dead) * 2 > len(self._keys) + len(self._pending):
+            self._merge()
+            self._keys = [item for item in self._keys if item not in self._dead]
+            self._dead.clear()
+
+    def walk(self, lo, hi, after=None) -> Iterator:
+        # ключи lo <= key < hi по порядку, начиная с первого ключа больше after (keyset-курсор);
+        # начало ищется через bisect, поэтому страница стоит O(log n + просмотренные ключи)
+        self._merge()
+        keys, dead = self._keys, self._dead
+        start = bisect_left(keys, lo)
+        if after is not None:
+            start = max(start, bisect_right(keys, after))
+        found = (keys[i] for i in range(start, bisect_left(keys, hi)))
+        return (key for key in found if key not in dead) if dead else found
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        if len(self._pending) < self.BULK:
+            for key in self._pending:
+                insort(self._keys, key)
+        else:
+            self._keys.extend(self._pending)
+            self._keys.sort()       # Timsort сливает уже отсортированную часть и хвост за O(n + k log k)
+        self._pending.clear()
+
+
+def _prefix_end(prefix: str) -> str:
+    # наименьшая строка больше всех строк, начинающихся с prefix
+    return prefix + '\U0010ffff'
+
+
+class UsernameTaken(ValueError):
+    pass
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Ключ курсора поиска для каждого порядка обхода (search_order)
+SEARCH_CURSOR_TYPES = {"username": (str,), "age": (int, int), "id": (int,)}
+
+
+def search_order(age_min: Optional[int], age_max: Optional[int], prefix: Optional[str]) -> str:
+    # По какому индексу идет поиск - от этого зависят порядок результата и вид курсора. Выбор не зависит
+    # от данных, поэтому курсор остается верным между страницами и одинаков у хранилища в памяти и SQLite
+    if prefix:
+        return "username"       # по username, возраст проверяется на каждой записи
+    if age_min is not None or age_max is not None:
+        return "age"            # по (age, id)
+    return "id"
+
+
+def check_cursor(order: str, after: Optional[tuple]) -> None:
+    types = SEARCH_CURSOR_TYPES[order]
+    if after is not None and (len(after) != len(types) or any(type(v) is not t for v, t in zip(after, types))):
+        raise InvalidCursor("курсор получен для другого поиска")
+
+
+class BatchRejected(ValueError):
+    def __init__(self, errors: Dict[int, str]):
+        super().__init__(f"{len(errors)} item(s) rejected")
+        self.errors = errors
+
+
+class UserRecord:
+    """
+    Пользователь в хранилище: слоты вместо __dict__ и служебных полей экземпляра BaseModel.
+    После создания запись не меняется (UserRepository заменяет ее новой), кроме кэша encoded -
+    JSON-байтов записи для режима fast_json.
+    """
+
+    __slots__ = ("id", "username", "age", "encoded")
+
+    def __init__(self, id: int, username: str, age: int):
+        self.id = id
+        self.username = username
+        self.age = age
+        self.encoded: Optional[bytes] = None
+
+    def __repr__(self) -> str:
+        return f"UserRecord(id={self.id!r}, username={self.username!r}, age={self.age!r})"
+
+
+USER_ROW_FIELDS = (("id", int), ("username", str), ("age", int))
+
+
+def _plain_user_model(model) -> bool:
+    # Проверяется один раз, при создании хранилища: модель User модулей приложения сериализуется в те же
+    # байты, что и схема UserRow, - поля ровно id: int, username: str, age: int в этом порядке, без alias,
+    # без приватных и лишних полей, computed_field, своих сериализаторов и model_post_init. Для любой
+    # другой модели кодирование идет через ее собственный сериализатор
+    fields = model.model_fields
+    return (tuple((name, field.annotation) for name, field in fields.items()) == USER_ROW_FIELDS
+            and all(field.alias is None and field.serialization_alias is None for field in fields.values())
+            and not model.__private_attributes__ and model.model_config.get("extra") != "allow"
+            and not model.model_computed_fields
+            and not model.__pydantic_decorators__.field_serializers
+            and not model.__pydantic_decorators__.model_serializers
+            and model.model_post_init is BaseModel.model_post_init)
+
+
+class UserRow(TypedDict):
+    id: int
+    username: str
+    age: int
+
+
+def _row(record: UserRecord) -> dict:
+    return {"id": record.id, "username": record.username, "age": record.age}
+
+
+def rows_encoder(model) -> Callable[[Iterable[UserRecord]], bytes]:
+    # Возвращает функцию "записи -> JSON-массив байтами": один вызов pydantic-core на весь список по схеме
+    # UserRow, без модели на каждую строку. Записи уже проверены на входе, поэтому повторной проверки
+    # response_model нет, а байты те же, что у сериализатора модели User
+    if not _plain_user_model(model):
+        to_model, adapter = model_builder(model), TypeAdapter(List[model])
+        return lambda records: adapter.dump_json([to_model(record) for record in records])
+    adapter = TypeAdapter(List[UserRow])
+    return lambda records: adapter.dump_json([_row(record) for record in records])
+
+
+def record_encoder(model) -> Callable[[UserRecord], bytes]:
+    # То же для одной записи (кэш fast_json, строки выгрузки NDJSON)
+    if not _plain_user_model(model):
+        to_model, to_json = model_builder(model), model.__pydantic_serializer__.to_json
+        return lambda record: to_json(to_model(record))
+    adapter = TypeAdapter(UserRow)
+    return lambda record: adapter.dump_json(_row(record))
+
+
+def model_builder(model) -> Callable[[UserRecord], object]:
+    # Возвращает функцию UserRecord -> model: публичный model_construct, без повторной проверки -
+    # данные записи уже проверены на входе. Нужна только там, где ответ - сама модель (один пользователь)
+    return lambda record: model.model_construct(id=record.id, username=record.username, age=record.age)
+
+
+class Snapshot:
+    """
+    Неизменяемый вид хранилища на момент version: записи по возрастанию id, кортежами по SNAPSHOT_CHUNK id.
+    Неизмененные куски общие у соседних снимков. Старый снимок освобождается, когда его отпускает
+    последний читатель.
+    """
+
+    __slots__ = ("version", "chunks", "_size", "__weakref__")
+
+    def __init__(self, version: int, chunks: tuple, size: int):
+        self.version = version
+        self.chunks = chunks
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[UserRecord]:
+        return chain.from_iterable(self.chunks)
+
+
+class UserRepository:
+    def __init__(self, model, fast_json: bool = False, storage=None, feed=None):
+        self.model = model              # класс User из модуля приложения (у каждого модуля он свой)
+        self.to_model = model_builder(model)
+        self.encode_rows = rows_encoder(model)
+        self.encode_record = record_encoder(model)
+        self.fast_json = fast_json      # отдавать ответы готовыми байтами, без повторной проверки response_model
+        self.bodies = VariantCache(MAX_CACHED_BODIES)   # (cursor, limit) -> (Encoded, next_cursor)
+        self.version = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._snapshots = weakref.WeakSet()     # снимки, которые еще кто-то читает
+        self._chunks: Dict[int, tuple] = {}     # номер куска (id // SNAPSHOT_CHUNK) -> записи в последнем снимке
+        self._dirty = set()                     # куски, измененные после последнего снимка
+        self._by_id: Dict[int, UserRecord] = {}
+        self._by_username: Dict[str, int] = {}
+        self._next_id = 1               # id не переиспользуются даже после удаления
+        self._order = IdIndex(self._by_id.__contains__)
+        self._by_age = SortedIndex()        # ключи (age, id)
+        self._names = SortedIndex()         # ключи username
+        self._lock = threading.Lock()
+        self._storage = storage
+        self.feed = feed
+        if storage is not None:
+            next_id, records = storage.recover()
+            for user_id in sorted(records):
+                self._add(UserRecord(user_id, records[user_id]['username'], records[user_id]['age']))
+            self._next_id = next_id
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def count(self) -> int:
+        return len(self._by_id)
+
+    def __bool__(self) -> bool:
+        return bool(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def all(self) -> Snapshot:
+        # id выдаются по возрастанию, а dict хранит порядок вставки - записи уже отсортированы по id
+        return self.snapshot()
+
+    @_locked
+    def snapshot(self) -> Snapshot:
+        return self._current_snapshot()
+
+    def _current_snapshot(self) -> Snapshot:
+        # Пока хранилище не менялось, все читатели получают один и тот же снимок - O(1). Первый читатель после
+        # изменения собирает заново только измененные куски (SNAPSHOT_CHUNK поисков по id на кусок) и кортеж
+        # из n / SNAPSHOT_CHUNK ссылок на куски; сами записи не копируются
+        snapshot = self._snapshot
+        if snapshot is None:
+            if len(self._dirty) * SNAPSHOT_CHUNK >= len(self._by_id):
+                self._rebuild_chunks()
+            else:
+                by_id = self._by_id
+                for number in sorted(self._dirty):
+                    start = number * SNAPSHOT_CHUNK
+                    chunk = tuple(filter(None, map(by_id.get, range(start, start + SNAPSHOT_CHUNK))))
+                    if chunk:
+                        self._chunks[number] = chunk    # новые куски - всегда с самыми большими id, порядок сохраняется
+                    else:
+                        self._chunks.pop(number, None)
+            self._dirty.clear()
+            snapshot = self._snapshot = Snapshot(self.version, tuple(self._chunks.values()), len(self._by_id))
+            self._snapshots.add(snapshot)
+        return snapshot
+
+    def _rebuild_chunks(self) -> None:
+        # изменена большая часть кусков (пакетная загрузка, восстановление): один проход по словарю
+        ids, records = list(self._by_id), iter(self._by_id.values())
+        self._chunks = {}
+        start = 0
+        while start < len(ids):
+            number = ids[start] // SNAPSHOT_CHUNK
+            stop = bisect_left(ids, (number + 1) * SNAPSHOT_CHUNK, start)
+            self._chunks[number] = tuple(islice(records, stop - start))
+            start = stop
+
+    @property
+    def live_snapshots(self) -> int:
+        return len(self._snapshots)
+
+    def get(self, user_id: int):
+        return self._by_id.get(user_id)
+
+    @_locked
+    def page(self, cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List, Optional[int]]:
+        return self._page(cursor, limit)
+
+    def _page(self, cursor: Optional[int], limit: Optional[int]) -> Tuple[List, Optional[int]]:
+        ids, next_cursor = self._order.page(cursor, limit)
+        return [self._by_id[user_id] for user_id in ids], next_cursor
+
+    @_locked
+    def search(self, age_min: Optional[int] = None, age_max: Optional[int] = None, prefix: Optional[str] = None,
+               after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List, Optional[tuple]]:
+        # Обходим индекс из search_order по порядку ключей и останавливаемся на limit + 1 подходящей записи.
+        # after и возвращаемый курсор - ключ последней записи: (username,), (age, id) или (id,)
+        order = search_order(age_min, age_max, prefix)
+        check_cursor(order, after)
+        if order == "id":
+            items, next_id = self._page(None if after is None else after[0], limit)
+            return items, None if next_id is None else (next_id,)
+        low = -1 if age_min is None else age_min
+        high = float('inf') if age_max is None else age_max
+        by_id, by_username = self._by_id, self._by_username
+        if order == "username":
+            users = (by_id[by_username[name]]
+                     for name in self._names.walk(prefix, _prefix_end(prefix), None if after is None else after[0]))
+            if age_min is not None or age_max is not None:
+                users = (user for user in users if low <= user.age <= high)
+            key = lambda user: (user.username,)
+        else:
+            lo = (age_min,) if age_min is not None else ()
+            hi = (age_max + 1,) if age_max is not None else (float('inf'),)
+            users = (by_id[user_id] for _, user_id in self._by_age.walk(lo, hi, after))
+            key = lambda user: (user.age, user.id)
+        items = list(users) if limit is None else list(islice(users, limit + 1))
+        if limit is not None and len(items) > limit:
+            del items[limit:]
+            return items, key(items[-1])
+        return items, None
+
+    def scan(self) -> Iterator[UserRecord]:
+        # Обход всех пользователей по снимку кусок за куском: одна согласованная версия без блокировки на
+        # каждую порцию, а куски общие с хранилищем, поэтому обход не копирует всех пользователей
+        return iter(self.snapshot())
+
+    def encode(self, user) -> bytes:
+        data = user.encoded
+        if data is None:
+            data = user.encoded = self.encode_record(user)
+        return data
+
+    def encode_list(self, items) -> bytes:
+        # fast_json склеивает кэш байтов каждой записи; без него кэш не наполняется (память на миллионы
+        # пользователей), список кодируется целиком за один вызов
+        if self.fast_json:
+            return b'[' + b','.join([self.encode(user) for user in items]) + b']'
+        return self.encode_rows(items)
+
+    def encode_page(self, cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[Encoded, Optional[int]]:
+        # Готовый JSON страницы GET /users; сжатые варианты строятся рядом с ним при первом запросе.
+        # Версия и страница читаются под одной блокировкой, поэтому тело не попадет в кэш с чужой версией
+        key = (cursor, limit)
+        with self._lock:
+            version = self.version
+            cached = self.bodies.lookup(key, version)
+            if cached is not None:
+                return cached
+            items, next_cursor = self._page(cursor, limit)
+        page = (Encoded(self.encode_list(items)), next_cursor)
+        self.bodies.put(key, version, page)
+        return page
+
+    def username_taken(self, username: str, exclude_id: Optional[int] = None) -> bool:
+        owner = self._by_username.get(username)
+        return owner is not None and owner != exclude_id
+
+    @_locked
+    def create(self, username: str, age: int):
+        if username in self._by_username:
+            raise UsernameTaken(username)
+        new_user = self._insert(username, age)
+        self._changed()
+        return new_user
+
+    @_locked
+    def update(self, user_id: int, username: str, age: int):
+        user = self._by_id.get(user_id)
+        if user is None:
+            return None
+        if self.username_taken(username, exclude_id=user_id):
+            raise UsernameTaken(username)
+        self._rename(user, username)
+        user = self._set(user, username, age)
+        self._changed()
+        return user
+
+    @_locked
+    def delete(self, user_id: int):
+        user = self._remove(user_id)
+        if user is not None:
+            self._changed()
+        return user
+
+    @_locked
+    def create_each(self, items: List[Tuple[str, int]]) -> List:
+        # Пакет независимых созданий (WriteCoalescer в coalescer.py собирает их из одновременных POST):
+        # одна блокировка, id выдаются подряд, журнал - одной записью, версия растет один раз.
+        # Ошибка элемента не отменяет остальные: на его месте в результате - исключение UsernameTaken.
+        results, created = [], []
+        for username, age in items:
+            if username in self._by_username:
+                results.append(UsernameTaken(username))
+            else:
+                user = self._insert(username, age, log=False)
+                results.append(user)
+                created.append(user)
+        if created:
+            self._log_many(created)
+            self._changed()
+        return results
+
+    # Пакетные операции: сначала проверяется весь пакет, и только если ошибок нет, он применяется целиком.
+    # Ошибки возвращаются в BatchRejected.errors по индексам элементов пакета.
+
+    @_locked
+    def create_many(self, items: List[Tuple[str, int]]) -> List:
+        errors, seen = {}, set()
+        for i, (username, _) in enumerate(items):
+            if username in seen or username in self._by_username:
+                errors[i] = "Username already exists"
+            seen.add(username)
+        if errors:
+            raise BatchRejected(errors)
+        created = [self._insert(username, age, log=False) for username, age in items]
+        self._log_many(created)
+        self._changed()
+        return created
+
+    @_locked
+    def update_many(self, items: List[Tuple[int, str, int]]) -> List:
+        errors, seen_ids, seen_names = {}, set(), set()
+        batch_ids = {user_id for user_id, _, _ in items}
+        for i, (user_id, username, _) in enumerate(items):
+            owner = self._by_username.get(username)
+            if user_id not in self._by_id:
+                errors[i] = "Пользователь не найден"
+            elif user_id in seen_ids:
+                errors[i] = "Duplicate user id in batch"
+            # имя занято, если его владелец не входит в пакет (владелец из пакета сам получит новое имя)
+            elif username in seen_names or (owner is not None and owner != user_id and owner not in batch_ids):
+                errors[i] = "Username already exists"
+            seen_ids.add(user_id)
+            seen_names.add(username)
+        if errors:
+            raise BatchRejected(errors)
+        # сначала освобождаем старые имена всех пользователей пакета - так работают и обмены именами (a <-> b)
+        updated = [self._by_id[user_id] for user_id, _, _ in items]
+        for user in updated:
+            del self._by_username[user.username]
+            self._names.remove(user.username)
+        for user, (_, username, age) in zip(updated, items):
+            self._by_username[username] = user.id
+            self._names.add(username)
+        updated = [self._set(user, username, age) for user, (_, username, age) in zip(updated, items)]
+        self._changed()
+        return updated
+
+    @_locked
+    def delete_many(self, user_ids: List[int]) -> List:
+        errors, seen = {}, set()
+        for i, user_id in enumerate(user_ids):
+            if user_id in seen:
+                errors[i] = "Duplicate user id in batch"
+            elif user_id not in self._by_id:
+                errors[i] = "Пользователь не найден"
+            seen.add(user_id)
+        if errors:
+            raise BatchRejected(errors)
+        deleted = [self._remove(user_id) for user_id in user_ids]
+        self._changed()
+        return deleted
+
+    def _insert(self, username: str, age: int, log: bool = True):
+        # данные уже проверены маршрутом (UserCreate / Path), поэтому собираем User без повторной валидации
+        new_user = UserRecord(self._next_id, username, age)
+        self._next_id += 1
+        self._add(new_user)
+        if log:
+            self._log(new_user)
+        self._publish("create", new_user)
+        return new_user
+
+    def _add(self, user) -> None:
+        self._by_id[user.id] = user
+        self._dirty.add(user.id // SNAPSHOT_CHUNK)
+        self._by_username[user.username] = user.id
+        self._order.append(user.id)
+        self._by_age.add((user.age, user.id))
+        self._names.add(user.username)
+
+    def _rename(self, user, username: str) -> None:
+        if user.username != username:
+            del self._by_username[user.username]
+            self._by_username[username] = user.id
+            self._names.remove(user.username)
+            self._names.add(username)
+
+    def _set(self, user, username: str, age: int) -> UserRecord:
+        # копирование при записи: старую запись дочитают те, кто ее уже получил (снимки, сериализация в потоке)
+        new_user = UserRecord(user.id, username, age)
+        if user.age != age:
+            self._by_age.remove((user.age, user.id))
+            self._by_age.add((age, user.id))
+        self._by_id[user.id] = new_user
+        self._dirty.add(user.id // SNAPSHOT_CHUNK)
+        self._log(new_user)
+        self._publish("update", new_user)
+        return new_user
+
+    def _remove(self, user_id: int):
+        user = self._by_id.pop(user_id, None)
+        if user is not None:
+            self._dirty.add(user_id // SNAPSHOT_CHUNK)
+            del self._by_username[user.username]
+            self._order.discard()
+            self._by_age.remove((user.age, user_id))
+            self._names.remove(user.username)
+            if self._storage is not None:
+                self._storage.delete(user_id)
+            if self.feed is not None:
+                self.feed.publish("delete", {"id": user_id})
+        return user
+
+    def _log(self, user) -> None:
+        if self._storage is not None:
+            self._storage.put(user.id, {"username": user.username, "age": user.age})
+
+    def _log_many(self, users: List) -> None:
+        if self._storage is not None and users:
+            self._storage.put_many([(user.id, {"username": user.username, "age": user.age}) for user in users])
+
+    def _publish(self, op: str, user: UserRecord) -> None:
+        if self.feed is not None:
+            self.feed.publish(op, {"id": user.id, "username": user.username, "age": user.age})
+
+    def _changed(self) -> None:
+        # вызывается один раз на каждую операцию изменения (и один раз на весь пакет)
+        self.version += 1
+        self._snapshot = None       # снимок прошлой версии живет, пока его читают
+        self.bodies.clear()
+        if self._storage is not None and self._storage.snapshot_due():
+            # снимок на диск пишет фоновый поток журнала по неизменяемому виду хранилища, а не этот запрос
+            view = self._current_snapshot()
+            self._storage.schedule_snapshot(self._next_id, lambda: (
+                (user.id, {"username": user.username, "age": user.age}) for user in view))
+
+
+class UserRecords:
+    """
+    Словарь users из pr_16_3_CRUD.py ({'1': 'Имя: ..., возраст: ...'}) с постоянной последовательностью id.
+
+    Следующий id хранится в счетчике, а не вычисляется через max(int(key) for key in users.keys()) + 1.
+    Так как id выдаются по возрастанию, порядок вставки в dict совпадает с числовым порядком id,
+    и GET /users отдает пользователей по порядку без сортировки строковых ключей.
+    """
+
+    def __init__(self, initial: Optional[Dict[str, str]] = None, storage=None):
+        self._records: Dict[str, str] = {}
+        self._next_id = 1
+        self._order = IdIndex(lambda item_id: str(item_id) in self._records)
+        self._lock = threading.Lock()
+        self._storage = storage
+        if storage is not None:
+            next_id, records = storage.recover()
+            if next_id > 1:
+                # в журнале уже есть данные - начальный словарь не нужен, иначе удаленные записи "воскреснут"
+                initial = {str(key): value for key, value in records.items()}
+        for key, value in sorted((initial or {}).items(), key=lambda item: int(item[0])):
+            self._records[key] = value
+            self._order.append(int(key))
+            self._next_id = max(self._next_id, int(key) + 1)
+            if storage is not None and next_id == 1:
+                storage.put(int(key), value)
+        if storage is not None:
+            self._next_id = max(self._next_id, next_id)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._records
+
+    def as_dict(self) -> Dict[str, str]:
+        return self._records
+
+    def get(self, user_id: str) -> Optional[str]:
+        return self._records.get(user_id)
+
+    @_locked
+    def page(self, cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[Dict[str, str], Optional[int]]:
+        ids, next_cursor = self._order.page(cursor, limit)
+        return {str(item_id): self._records[str(item_id)] for item_id in ids}, next_cursor
+
+    @_locked
+    def add(self, record: str) -> str:
+        user_id = str(self._next_id)
+        self._next_id += 1
+        self._records[user_id] = record
+        self._order.append(self._next_id - 1)
+        self._log(user_id, record)
+        return user_id
+
+    @_locked
+    def set(self, user_id: str, record: str) -> bool:
+        if user_id not in self._records:
+            return False
+        self._records[user_id] = record
+        self._log(user_id, record)
+        return True
+
+    @_locked
+    def delete(self, user_id: str) -> Optional[str]:
+        record = self._records.pop(user_id, None)
+        if record is not None:
+            self._order.discard()
+            if self._storage is not None:
+                self._storage.delete(int(user_id))
+                self._snapshot_if_due()
+        return record
+
+    def _log(self, user_id: str, record: str) -> None:
+        if self._storage is not None:
+            self._storage.put(int(user_id), record)
+            self._snapshot_if_due()
+
+    def _snapshot_if_due(self) -> None:
+        if self._storage.snapshot_due():
+            # записи - неизменяемые строки, поэтому фоновому потоку журнала хватает копии пар словаря
+            items = list(self._records.items())
+            self._storage.schedule_snapshot(self._next_id, lambda: ((int(key), value) for key, value in items))
@@ -0,0 +1,396 @@
+"""
+Постоянное хранение для in-memory хранилищ пользователей (UserRepository, UserRecords).
+
+Чтения по-прежнему идут из памяти, а каждое изменение дописывается в журнал (write-ahead log):
+    - журнал users.wal - строки JSON [seq, "put", id, значение] / [seq, "del", id];
+    - записи копятся в буфере, фоновый поток сбрасывает их на диск одним write + fsync (group commit):
+      сотня изменений, пришедших за время одного fsync, стоит одного fsync;
+    - каждые snapshot_every записей хранилище передает неизменяемый вид своих данных, и отдельный поток
+      сохраняет его в снимок users.snapshot (через временный файл и os.replace), после чего из журнала
+      удаляются записи, которые уже есть в снимке. Ни запросы, ни group commit в это время не ждут;
+    - при старте снимок читается через mmap, затем из журнала применяются записи с seq новее снимка.
+
+Подтверждение записи. По умолчанию (durable) маршрут записи отвечает только после fsync, который покрыл
+его изменение: install_group_commit(app, storage) ставит это ожидание на маршруты POST / PUT / PATCH / DELETE,
+а одновременные запросы ждут одного общего fsync. USERS_WAL_ASYNC=1 включает подтверждение до fsync:
+ответ приходит сразу, буфер сбрасывается раз в commit_interval секунд, и при сбое теряются записи
+за последний интервал (как appendfsync everysec в Redis). Вызов commit() сбрасывает буфер немедленно.
+
+Включается переменной окружения USERS_DATA_DIR: open_storage("pydantic") вернет WalStorage
+в подкаталоге USERS_DATA_DIR/pydantic, а без переменной - None (только память, как раньше).
+
+Журнал пишет только один процесс: каталог блокируется файлом LOCK. Второй воркер с тем же каталогом
+получит ошибку при старте, а не будет молча дописывать свою версию данных в чужой журнал.
+"""
+
+import asyncio
+import atexit
+import json
+import mmap
+import os
+import threading
+from typing import AbstractSet, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, FastAPI
+from fastapi.routing import APIRoute, request_response
+
+try:
+    import fcntl
+except ImportError:     # Windows: блокировки каталога нет
+    fcntl = None
+
+DATA_DIR = os.getenv('USERS_DATA_DIR')
+DURABLE = os.getenv('USERS_WAL_ASYNC', '') != '1'
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _fsync_directory(path: str) -> None:
+    # os.replace меняет запись в каталоге: без fsync каталога переименование может пропасть при сбое
+    if not hasattr(os, 'O_DIRECTORY'):     # Windows: каталог так не открыть
+        return
+    fd = os.open(os.path.dirname(path), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class WalStorage:
+    def __init__(self, directory: str, commit_interval: float = 0.005, snapshot_every: int = 100_000,
+                 durable: bool = DURABLE):
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'users.snapshot')
+        self.wal_path = os.path.join(directory, 'users.wal')
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self.durable = durable
+        self._seq = 0
+        self._since_snapshot = 0
+        self._buffer: List[bytes] = []
+        self._buffered_seq = 0                  # seq последней записи, попавшей в буфер
+        self._durable_seq = 0                   # seq последней записи, которая уже на диске после fsync
+        self._waiters: List[tuple] = []         # (seq, loop, future) маршрутов, ждущих fsync
+        self._pending_snapshot = None           # (next_id, seq, items) для потока снимков
+        self._snapshotter: Optional[threading.Thread] = None
+        self._lock = threading.Lock()           # буфер, seq и ожидающие - короткие операции запросов
+        self._io_lock = threading.Lock()        # файл журнала: write, fsync, обрезка после снимка
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._wal = None
+        self._flusher = None
+        self._lock_file = None
+
+    # --- восстановление ---
+
+    def _lock_directory(self) -> None:
+        if fcntl is None:
+            return
+        self._lock_file = open(os.path.join(os.path.dirname(self.wal_path), 'LOCK'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(
+                f'{os.path.dirname(self.wal_path)} уже используется другим процессом. '
+                f'Для нескольких воркеров используйте общее хранилище USERS_BACKEND=sqlite')
+
+    def recover(self) -> Tuple[int, Dict[int, object]]:
+        # Возвращает (следующий id, {id: значение}) и открывает журнал для дозаписи
+        self._lock_directory()
+        next_id, records = 1, {}
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path) and os.path.getsize(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = json.loads(mm.readline())
+                next_id, snapshot_seq = header['next_id'], header['seq']
+                for line in iter(mm.readline, b''):
+                    key, value = json.loads(line)
+                    records[key] = value
+        self._seq = snapshot_seq
+        for entry in self._read_wal():
+            seq, op, key = entry[0], entry[1], entry[2]
+            if seq <= snapshot_seq:
+                continue
+            if op == 'put':
+                records[key] = entry[3]
+                next_id = max(next_id, key + 1)
+            else:
+                records.pop(key, None)
+            self._seq = seq
+            self._since_snapshot += 1
+        self._buffered_seq = self._durable_seq = self._seq
+        self._wal = open(self.wal_path, 'ab')
+        self._flusher = threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+        return next_id, records
+
+    def _read_wal(self) -> Iterator[list]:
+        if not os.path.exists(self.wal_path):
+            return
+        valid = 0
+        with open(self.wal_path, 'r+b') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # недописанная последняя строка после сбоя: отрезаем ее, иначе новые записи
+                    # окажутся после битой строки и не прочитаются при следующем старте
+                    f.truncate(valid)
+                    return
+                valid += len(line)
+                yield entry
+
+    # --- запись ---
+
+    @property
+    def last_seq(self) -> int:
+        return self._buffered_seq
+
+    def put(self, key: int, value) -> None:
+        self._append([[self._next_seq(), 'put', key, value]])
+
+    def put_many(self, items: List[Tuple[int, object]]) -> None:
+        # пакет изменений - одна запись в буфер под одной блокировкой; на диск уйдет тем же group commit
+        self._append([[self._next_seq(), 'put', key, value] for key, value in items])
+
+    def delete(self, key: int) -> None:
+        self._append([[self._next_seq(), 'del', key]])
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _append(self, entries: List[list]) -> None:
+        lines = [json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode() + b'\n' for entry in entries]
+        with self._lock:
+            self._buffer.extend(lines)
+            self._buffered_seq = entries[-1][0]
+        self._since_snapshot += len(lines)
+
+    def commit(self) -> None:
+        # Буфер забирается под _lock, а write и fsync идут под _io_lock: запросы, которые дописывают
+        # в буфер, не ждут диска. _io_lock взят первым, поэтому буферы попадают в файл по порядку seq
+        with self._io_lock:
+            if self._wal is None:
+                return
+            lines, upto = self._take_buffer()
+            if not lines:
+                return
+            self._wal.write(b''.join(lines))
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+        self._synced_upto(upto)
+
+    def _take_buffer(self) -> Tuple[List[bytes], int]:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            return lines, self._buffered_seq
+
+    def _synced_upto(self, upto: int) -> None:
+        with self._lock:
+            self._durable_seq = max(self._durable_seq, upto)
+            ready = [waiter for waiter in self._waiters if waiter[0] <= upto]
+            self._waiters = [waiter for waiter in self._waiters if waiter[0] > upto]
+        for _, loop, future in ready:
+            self._notify(loop, _wake, future)
+
+    def synced(self, seq: int) -> Optional[asyncio.Future]:
+        # Future, который завершится после fsync записи seq; None - ждать нечего (уже на диске или не durable)
+        if not self.durable:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if seq <= self._durable_seq:
+                return None
+            future = loop.create_future()
+            self._waiters.append((seq, loop, future))
+        self._wakeup.set()      # не ждем commit_interval: fsync начнется сразу, а пока он идет, копится следующий
+        return future
+
+    @staticmethod
+    def _notify(loop, callback, *args) -> None:
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:    # event loop маршрута уже закрыт
+            pass
+
+    def _fail_waiters(self, error: Exception) -> None:
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for _, loop, future in waiters:
+            self._notify(loop, lambda f: f.done() or f.set_exception(error), future)
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.commit_interval)
+            self._wakeup.clear()
+            try:
+                self.commit()
+            except OSError as e:
+                self._fail_waiters(e)
+
+    # --- снимки ---
+
+    def snapshot_due(self) -> bool:
+        return self._since_snapshot >= self.snapshot_every
+
+    def schedule_snapshot(self, next_id: int, items: Callable[[], Iterator[Tuple[int, object]]]) -> None:
+        # Вызывается хранилищем под его блокировкой. items обходит неизменяемый вид данных на момент вызова,
+        # поэтому снимок пишется в отдельном потоке, пока хранилище продолжает меняться. Если прошлый снимок
+        # еще пишется, новый запрос заменит ожидающий и будет записан следом
+        with self._lock:
+            self._pending_snapshot = (next_id, self._buffered_seq, items)
+            if self._snapshotter is None:
+                self._snapshotter = threading.Thread(target=self._snapshot_loop, name='wal-snapshot', daemon=True)
+                self._snapshotter.start()
+        self._since_snapshot = 0
+
+    def _snapshot_loop(self) -> None:
+        while True:
+            with self._lock:
+                pending, self._pending_snapshot = self._pending_snapshot, None
+                if pending is None or self._closed:
+                    self._snapshotter = None
+                    return
+            try:
+                self._write_snapshot(*pending)
+            except OSError:
+                pass    # снимок - только ускорение старта: журнал остается полным, попробуем на следующем
+
+    def _write_snapshot(self, next_id: int, seq: int, items: Callable[[], Iterator[Tuple[int, object]]]) -> None:
+        # Снимок становится на место только целиком и только пока журнал открыт: close() прерывает запись,
+        # и временный файл удаляется. Переименование закрепляется fsync каталога до обрезки журнала
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            complete = self._write_snapshot_file(tmp_path, next_id, seq, items)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        if not complete:
+            _remove(tmp_path)
+            return
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_directory(self.snapshot_path)
+        self._trim_wal(seq)
+
+    def _write_snapshot_file(self, path: str, next_id: int, seq: int,
+                             items: Callable[[], Iterator[Tuple[int, object]]]) -> bool:
+        with open(path, 'wb') as f:
+            f.write(json.dumps({'next_id': next_id, 'seq': seq}).encode() + b'\n')
+            for key, value in items():
+                if self._closed:
+                    return False
+                f.write(json.dumps([key, value], ensure_ascii=False, separators=(',', ':')).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+    def _trim_wal(self, seq: int) -> None:
+        # Оставляем в журнале только записи новее снимка: пока он писался, журнал продолжал расти
+        with self._io_lock:
+            if self._wal is None:
+                return
+            lines, upto = self._take_buffer()
+            self._wal.write(b''.join(lines))
+            self._wal.close()
+            try:
+                with open(self.wal_path, 'rb') as f:
+                    f.seek(self._tail_offset(f, seq))
+                    tail = f.read()
+                tmp_path = self.wal_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.wal_path)
+                _fsync_directory(self.wal_path)     # иначе после сбоя новые записи окажутся в потерянном файле
+            finally:
+                self._wal = open(self.wal_path, 'ab')
+        self._synced_upto(upto)
+
+    @staticmethod
+    def _tail_offset(f, seq: int) -> int:
+        # Смещение первой записи новее seq. Записи в журнале идут по возрастанию seq и строки целые
+        # (недописанную строку отрезает recover), поэтому ищем двоичным поиском, не разбирая весь журнал
+        if not os.fstat(f.fileno()).st_size:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lo, hi = 0, len(mm)     # начала строк; ответ между ними
+            while lo < hi:
+                start = mm.rfind(b'\n', 0, (lo + hi) // 2) + 1
+                end = mm.find(b'\n', start) + 1 or len(mm)
+                if json.loads(mm[start:end])[0] > seq:
+                    hi = start
+                else:
+                    lo = end
+            return lo
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        # поток снимка видит _closed и прерывает запись; ждем его и поток журнала, пока файл и LOCK наши
+        with self._lock:
+            snapshotter = self._snapshotter
+        for thread in (snapshotter, self._flusher):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self.commit()
+        with self._io_lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+        if self._lock_file is not None:
+            self._lock_file.close()     # закрытие файла снимает flock
+            self._lock_file = None
+
+
+def open_storage(name: str) -> Optional[WalStorage]:
+    if not DATA_DIR:
+        return None
+    return WalStorage(os.path.join(DATA_DIR, name))
+
+
+def _group_commit(get_route_handler, storage: WalStorage):
+    # как допуск в admission.py, обертка ставится на get_route_handler и переживает include_router
+    def group_commit_route_handler():
+        handler = get_route_handler()
+
+        async def synced(request):
+            before = storage.last_seq
+            response = await handler(request)
+            if storage.last_seq != before:
+                # ждем fsync, который покрыл записи этого запроса (и всех, кто писал одновременно с ним)
+                waiter = storage.synced(storage.last_seq)
+                if waiter is not None:
+                    await waiter
+            return response
+        return synced
+    return group_commit_route_handler
+
+
+def install_group_commit(app: Union[FastAPI, APIRouter], storage: Optional[WalStorage],
+                         methods: AbstractSet[str]) -> None:
+    # Вызывается в конце модуля после маршрутов; ожидание fsync ставится на маршруты с методами из methods
+    # (модули передают WRITE_METHODS из admission.py). Без журнала или с USERS_WAL_ASYNC=1 ничего не делает
+    if storage is None or not storage.durable:
+        return
+    for route in app.routes:
+        if (isinstance(route, APIRoute) and route.methods & methods
+                and getattr(route, "storage", None) is None):
+            route.get_route_handler = _group_commit(route.get_route_handler, storage)
+            route.app = request_response(route.get_route_handler())
+            route.storage = storage